@@ -50,13 +50,58 @@ def create_parser():
     parser.add_argument("-e", action="store_true", help="Chip erase")
     parser.add_argument("-v", action="store_true", help="Enable verification")
     parser.add_argument("-t", action="store_true", help="Interactive mode")
+    parser.add_argument("-w", type=int, default=1,
+                        help="Number of program memory packets in flight")
+    parser.add_argument("--read-ahead", type=int, default=1,
+                        help="Number of read requests in flight")
+    parser.add_argument("-D", action="store_true",
+                        help="Send job to running big_black_daemon")
+    parser.add_argument("-i", action="store_true",
+                        help="Write only flash pages changed since last "
+                             "write")
+    parser.add_argument("-z", action="store_true",
+                        help="Compress memory packets if programmer "
+                             "supports it")
+
+    return parser
+
+
+def create_batch_parser():
+    parser = create_parser()
+
+    parser.add_argument("-a", action='append',
+                        help="Programmer address host[:port]")
+    parser.add_argument("-d", action="store_true",
+                        help="Add discovered programmers to targets")
+    parser.add_argument("-W", type=float, default=2.,
+                        help="Discovery window in seconds")
+    parser.add_argument("-j", type=int, default=8,
+                        help="Number of programmers flashed at once")
 
     return parser
 
 
 def parse(parser, args_list=None):
     args = parser.parse_args(args_list)
+    return __make_opts(parser, args)
+
+
+def parse_batch(parser, args_list=None):
+    args = parser.parse_args(args_list)
+    parsed = __make_opts(parser, args)
+
+    if args.j < 1:
+        parser.error("Number of jobs must be at least 1")
+
+    parsed['targets'] = args.a if args.a is not None else []
+    parsed['discover'] = args.d
+    parsed['discovery_window'] = args.W
+    parsed['jobs'] = args.j
+
+    return parsed
+
 
+def __make_opts(parser, args):
     parsed = {}
     parsed['interactive'] = args.t
     parsed['erase'] = args.e
@@ -64,6 +109,17 @@ def parse(parser, args_list=None):
     parsed['port'] = args.P
     parsed['part'] = args.p
 
+    if args.w < 1:
+        parser.error("Window size must be at least 1")
+    parsed['window'] = args.w
+
+    if args.read_ahead < 1:
+        parser.error("Read ahead must be at least 1")
+    parsed['read_ahead'] = args.read_ahead
+    parsed['daemon'] = args.D
+    parsed['differential'] = args.i
+    parsed['compression'] = args.z
+
     if args.U is not None:
         for memory_op in args.U:
             memory, op, file_or_fuse = __parse_memory_op(memory_op)
@@ -0,0 +1,115 @@
+"""
+Compares STM CRC32 engine with the previous word by word implementation
+    on firmwares from test_firmwares/firmwares.
+
+Run from repository root:
+    python -m benchmarks.crc32_benchmark
+"""
+from programmers.crc32 import CRC32, StmCrc32, STM_POLY, _make_table
+from programmers.hardware_programmer import load_image
+
+from timeit import timeit
+
+import os
+
+FIRMWARES_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             os.pardir, "test_firmwares", "firmwares")
+
+# Images are repeated to get size of the largest parts
+REPEAT_TO = 256 * 1024
+
+
+def legacy_crc32_stm(table, bytes_arr):
+    """
+    Previous implementation: one 32-bit word per iteration
+    """
+    length = len(bytes_arr)
+    crc = 0xffffffff
+
+    k = 0
+    while length >= 4:
+        v = ((bytes_arr[k] << 24) & 0xFF000000) |\
+            ((bytes_arr[k+1] << 16) & 0xFF0000) |\
+            ((bytes_arr[k+2] << 8) & 0xFF00) | (bytes_arr[k+3] & 0xFF)
+
+        crc = ((crc << 8) & 0xffffffff) ^ table[0xFF & ((crc >> 24) ^ v)]
+        crc = ((crc << 8) & 0xffffffff) ^ table[0xFF & ((crc >> 24) ^
+                                                        (v >> 8))]
+        crc = ((crc << 8) & 0xffffffff) ^ table[0xFF & ((crc >> 24) ^
+                                                        (v >> 16))]
+        crc = ((crc << 8) & 0xffffffff) ^ table[0xFF & ((crc >> 24) ^
+                                                        (v >> 24))]
+
+        k += 4
+        length -= 4
+
+    if length > 0:
+        v = 0
+
+        for i in range(length):
+            v |= (bytes_arr[k+i] << 24-i*8)
+
+        for shift in (0, 8, 16, 24):
+            crc = ((crc << 8) & 0xffffffff) ^ table[0xFF & ((crc >> 24) ^
+                                                            (v >> shift))]
+
+    return crc
+
+
+def table_crc32_stm(data):
+    """
+    Table driven path which is used without zlib
+    """
+    return StmCrc32(data, use_zlib=False).value()
+
+
+def load_firmwares():
+    firmwares = []
+
+    for fname in sorted(os.listdir(FIRMWARES_DIR)):
+        if fname.split('.')[-1] not in ('hex', 'bin'):
+            continue
+
+        data = load_image(os.path.join(FIRMWARES_DIR, fname)).tobinstr()
+        firmwares.append((fname, data))
+
+    return firmwares
+
+
+def bench(func, number):
+    return timeit(func, number=number) / number
+
+
+def main():
+    table = _make_table(STM_POLY)
+    crc32 = CRC32()
+
+    print("%-24s %8s %12s %12s %12s %8s" %
+          ("firmware", "bytes", "legacy, ms", "table, ms", "engine, ms",
+           "speedup"))
+
+    firmwares = load_firmwares()
+    firmwares.append(("all, %d KB" % (REPEAT_TO // 1024),
+                      b''.join(data for _, data in firmwares) *
+                      (REPEAT_TO // sum(len(d) for _, d in firmwares) + 1)))
+
+    for fname, data in firmwares:
+        expected = legacy_crc32_stm(table, data)
+
+        if (crc32.crc32_stm(data) != expected) or\
+                (table_crc32_stm(data) != expected):
+            raise AssertionError("CRC of %s differs" % fname)
+
+        number = max(1, 200000 // (len(data) + 1))
+
+        legacy = bench(lambda: legacy_crc32_stm(table, data), number)
+        table_t = bench(lambda: table_crc32_stm(data), number)
+        engine = bench(lambda: crc32.crc32_stm(data), number * 10)
+
+        print("%-24s %8d %12.3f %12.3f %12.3f %7.0fx" %
+              (fname, len(data), legacy * 1000, table_t * 1000,
+               engine * 1000, legacy / engine))
+
+
+if __name__ == "__main__":
+    main()
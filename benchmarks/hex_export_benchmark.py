@@ -0,0 +1,110 @@
+"""
+Compares hex export of memory dumps with the previous per-byte
+    dictionary conversion.
+
+Run from repository root:
+    python -m benchmarks.hex_export_benchmark
+"""
+from programmers.hardware_programmer import load_image
+from programmers.memory_dump import create_dump_writer
+
+from intelhex import IntelHex
+from time import time
+
+import os
+import tempfile
+
+FIRMWARES_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             os.pardir, "test_firmwares", "firmwares")
+
+FLASH_SIZE = 256 * 1024
+
+
+def legacy_save_hex(fname, memory):
+    """
+    Previous export: dict entry for every programmed byte
+    """
+    mem_map = {}
+
+    for addr in range(0, len(memory), 2):
+        low_byte = memory[addr]
+        high_byte = memory[addr+1]
+
+        if (low_byte != 0xFF) or (high_byte != 0xFF):
+            mem_map[addr] = low_byte
+            mem_map[addr+1] = high_byte
+
+    intel_hex = IntelHex()
+    intel_hex.fromdict(mem_map)
+
+    with open(fname, 'w') as f:
+        intel_hex.tofile(f, 'hex')
+
+
+def save_hex(fname, memory):
+    writer = create_dump_writer(fname, 'flash', len(memory))
+    writer.write(0, memory)
+    writer.finish()
+
+
+def make_memories():
+    """
+    Full chip dumps: erased one, half filled with firmwares and full one
+    """
+    firmware = load_image(os.path.join(FIRMWARES_DIR, "Racer.hex"))
+    data = bytes(firmware.tobinarray())
+
+    half = bytearray(b'\xff' * FLASH_SIZE)
+    filled = (data * (FLASH_SIZE // 2 // len(data)))
+    half[:len(filled)] = filled
+
+    full = (data * (FLASH_SIZE // len(data) + 1))[:FLASH_SIZE]
+
+    return [("erased", bytearray(b'\xff' * FLASH_SIZE)),
+            ("half", half),
+            ("full", bytearray(full))]
+
+
+def check(fname, memory):
+    intel_hex = IntelHex()
+    intel_hex.fromfile(fname, format='hex')
+
+    restored = bytearray(b'\xff' * len(memory))
+    for start, stop in intel_hex.segments():
+        restored[start:stop] = intel_hex.tobinarray(start=start,
+                                                    end=stop - 1)
+
+    if restored != memory:
+        raise AssertionError("Exported hex differs from memory")
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    legacy_fname = os.path.join(directory, "legacy.hex")
+    fname = os.path.join(directory, "dump.hex")
+
+    print("%-10s %12s %12s %8s" % ("memory", "legacy, ms", "writer, ms",
+                                   "speedup"))
+
+    for name, memory in make_memories():
+        time0 = time()
+        legacy_save_hex(legacy_fname, memory)
+        legacy = time() - time0
+
+        time0 = time()
+        save_hex(fname, memory)
+        writer = time() - time0
+
+        check(fname, memory)
+
+        print("%-10s %12.1f %12.1f %7.0fx" % (name, legacy * 1000,
+                                               writer * 1000,
+                                               legacy / writer))
+
+    for f in (legacy_fname, fname):
+        os.unlink(f)
+    os.rmdir(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Writes, verifies and reads back full 256 KB image of ATmega2560 through
+    the fake programmer. Shows how many extended address instructions
+    are needed and how send window and read ahead affect it.
+
+Run from repository root:
+    python -m benchmarks.large_flash_benchmark
+"""
+from network import NetworkManager, PacketManager
+from network.fake_device import FakeDevice
+from programmers.avr.avr_programmer import AvrProgrammer, load_part
+from programmers.avr.avr_defs import Avr
+from programmers.hardware_programmer import load_image
+
+from intelhex import IntelHex
+from time import time
+
+import contextlib
+import io
+import os
+import tempfile
+
+FIRMWARES_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                             os.pardir, "test_firmwares", "firmwares")
+
+PART = "m2560"
+
+
+def make_image(size):
+    """
+    returns IntelHex which fills the whole flash with copies of firmware
+    """
+    firmware = load_image(os.path.join(FIRMWARES_DIR, "Racer.hex"))
+    data = bytes(firmware.tobinarray())
+
+    intel_hex = IntelHex()
+    intel_hex.frombytes((data * (size // len(data) + 1))[:size])
+
+    return intel_hex
+
+
+def run(mcu_info, image_fname, image, window_size, read_ahead):
+    device = FakeDevice.from_part(mcu_info)
+    device.start()
+
+    dump_fname = image_fname + ".dump.bin"
+
+    # Programmer is talkative
+    with contextlib.redirect_stdout(io.StringIO()):
+        packet_manager = PacketManager(NetworkManager(device.address))
+        packet_manager.start()
+
+        programmer = AvrProgrammer(PART, packet_manager, window_size,
+                                   mcu_info=mcu_info)
+        programmer.read_ahead = read_ahead
+        programmer.init_programmer()
+        programmer.send_chip_erase()
+
+        time0 = time()
+        programmer.burn_file(image_fname, "flash", validate=True)
+        write_time = time() - time0
+
+        time0 = time()
+        programmer.read_memory("flash", dump_fname)
+        read_time = time() - time0
+
+        programmer.stop_programmer()
+        packet_manager.stop()
+
+    device.stop()
+
+    with open(dump_fname, "rb") as f:
+        dump = f.read()
+    os.unlink(dump_fname)
+
+    expected = bytes(image.tobinarray())
+    if (bytes(device.flash) != expected) or (dump != expected):
+        raise AssertionError("Flash differs from image")
+
+    return (write_time, read_time,
+            device.commands_count.get(Avr.AVR_LD_EXT_ADDR_B1, 0))
+
+
+def main():
+    mcu_info = load_part(PART)
+    size = int(mcu_info["memory_flash"]["size"])
+
+    directory = tempfile.mkdtemp()
+    image_fname = os.path.join(directory, "image.hex")
+
+    image = make_image(size)
+    image.tofile(image_fname, format="hex")
+
+    print("%d KB image of %s" % (size // 1024, PART))
+    print("%-8s %-10s %10s %10s %14s" % ("window", "read ahead",
+                                         "write, s", "read, s",
+                                         "ext. address"))
+
+    for window_size, read_ahead in ((1, 1), (4, 4), (8, 8)):
+        write_time, read_time, loads = run(mcu_info, image_fname, image,
+                                           window_size, read_ahead)
+
+        print("%-8d %-10d %10.2f %10.2f %14d" % (window_size, read_ahead,
+                                                 write_time, read_time,
+                                                 loads))
+
+    os.unlink(image_fname)
+    os.rmdir(directory)
+
+
+if __name__ == "__main__":
+    main()
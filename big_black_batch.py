@@ -0,0 +1,158 @@
+import avrdude_input as avd
+import errors as err
+
+from network.observer import discover
+from network.network_manager import NetworkManager
+from network.packet_manager import PacketManager
+from network import network_exceptions as net_ex
+
+from programmers.avr.avr_programmer import AvrProgrammer, load_part
+from programmers.flash_record import FlashRecordStore
+from programmers.operation_timings import OperationTimingsStore
+from programmers.capabilities_store import CapabilitiesStore
+from programmers.hardware_programmer import load_image
+from programmers import programmer_exceptions as p_ex
+
+from big_black_programmer import ESP_PORT, run_fuse_ops
+
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+import socket
+import sys
+
+
+def parse_target(target):
+    """
+    Converts host[:port] into address tuple
+    """
+    host, _, port = target.partition(':')
+
+    if port:
+        return (host, int(port))
+
+    return (host, ESP_PORT)
+
+
+def flash_target(esp_addr, mmcu, mcu_info, images, opts):
+    """
+    Runs the whole job on single programmer.
+
+    images  --- dict[memory] = IntelHex. Shared by all workers.
+
+    returns dict with target, status, time and error
+    """
+    result = {"target": "%s:%d" % esp_addr, "status": "OK",
+              "time": 0., "error": ""}
+
+    time0 = time()
+    packet_manager = PacketManager(NetworkManager(esp_addr))
+
+    try:
+        packet_manager.start()
+
+        programmer = AvrProgrammer(mmcu, packet_manager, opts['window'],
+                                   mcu_info=mcu_info,
+                                   flash_records=FlashRecordStore(),
+                                   timings_store=OperationTimingsStore(),
+                                   capabilities_store=CapabilitiesStore(),
+                                   read_ahead=opts['read_ahead'],
+                                   use_compression=opts['compression'])
+        programmer.init_programmer()
+
+        try:
+            if opts['erase'] or (('flash' in images) and
+                                 not opts['differential']):
+                programmer.send_chip_erase()
+
+            for memory in ('flash', 'eeprom'):
+                if memory in images:
+                    programmer.burn_image(images[memory], memory, None,
+                                          opts['validate'],
+                                          opts['differential'])
+
+            run_fuse_ops(programmer, opts)
+        finally:
+            programmer.stop_programmer()
+
+    except (net_ex.NetworkBaseError, p_ex.ProgrammerBaseError,
+            socket.error) as e:
+        result["status"] = "FAIL"
+        result["error"] = str(e)
+
+    finally:
+        try:
+            packet_manager.stop()
+        except (IOError, socket.error):
+            pass
+
+    result["time"] = time() - time0
+    return result
+
+
+def print_results(results):
+    print("%-22s %-6s %9s  %s" % ("Target", "Status", "Time, s", "Error"))
+
+    for result in results:
+        print("%-22s %-6s %9.3f  %s" % (result["target"], result["status"],
+                                        result["time"], result["error"]))
+
+
+if __name__ == "__main__":
+    parser = avd.create_batch_parser()
+    opts = avd.parse_batch(parser)
+
+    mmcu = opts['part']
+
+    if mmcu is None:
+        print("Please specify the MCU part with -p option.")
+        exit(err.ARGUMENTS_ERROR)
+
+    targets = [parse_target(t) for t in opts['targets']]
+
+    if opts['discover']:
+        try:
+            for address in discover(opts['discovery_window']):
+                if (address, ESP_PORT) not in targets:
+                    targets.append((address, ESP_PORT))
+
+        except net_ex.NetworkConnectionError as e:
+            sys.stderr.write(str(e)+'\r\n')
+
+    if len(targets) == 0:
+        print("No programmers to flash. Use -a or -d option.")
+        exit(err.ARGUMENTS_ERROR)
+
+    # Image and part are parsed once for all programmers
+    images = {}
+    for memory in ('flash', 'eeprom'):
+        if opts[memory] is not None:
+            op, fname = opts[memory]
+
+            if op != 'w':
+                print("Only writing is supported in batch mode")
+                exit(err.ARGUMENTS_ERROR)
+
+            images[memory] = load_image(fname)
+
+    try:
+        mcu_info = load_part(mmcu)
+    except p_ex.ProgrammerBaseError as e:
+        sys.stderr.write(str(e)+'\r\n')
+        exit(err.AVR_ERROR)
+
+    time0 = time()
+
+    with ThreadPoolExecutor(max_workers=opts['jobs']) as executor:
+        futures = [executor.submit(flash_target, target, mmcu, mcu_info,
+                                   images, opts)
+                   for target in targets]
+
+        results = [f.result() for f in futures]
+
+    print_results(results)
+    print("Total time is " + str(round(time() - time0, 3)))
+
+    if any(result["status"] != "OK" for result in results):
+        exit(err.NETWORK_ERROR)
+
+    exit(err.ERROR_OK)
@@ -0,0 +1,224 @@
+import errors as err
+
+from network.observer import observe
+from network.network_manager import NetworkManager
+from network.packet_manager import PacketManager
+from network import network_exceptions as net_ex
+
+from programmers.avr.avr_programmer import AvrProgrammer
+from programmers.hardware_programmer import DEFAULT_READ_AHEAD
+from programmers.flash_record import FlashRecordStore
+from programmers.operation_timings import OperationTimingsStore
+from programmers.capabilities_store import CapabilitiesStore
+from programmers.image_cache import ImageCache
+from programmers import programmer_exceptions as p_ex
+
+from big_black_programmer import ESP_PORT, run_job
+
+import argparse
+import contextlib
+import json
+import os
+import socket
+import sys
+import traceback
+
+from io import StringIO
+
+
+DEFAULT_SOCKET = os.environ.get("BIGBLACK_DAEMON_SOCKET",
+                                os.path.join(os.path.expanduser("~"),
+                                             ".bigblack", "daemon.sock"))
+
+# Jobs and answers are single JSON lines
+MAX_MESSAGE_SIZE = 1 << 20
+
+
+class ProgrammerSession(object):
+    """
+    Keeps connection with ESP and initialized programmer between jobs.
+        Session is reopened if part changes or connection fails.
+    """
+
+    def __init__(self):
+        self.packet_manager = None
+        self.programmer = None
+        self.part = None
+
+    def get_programmer(self, part, window_size, use_compression=False,
+                       read_ahead=DEFAULT_READ_AHEAD):
+        if (self.programmer is not None) and (self.part == part) and\
+                (self.programmer.use_compression == use_compression):
+            self.programmer.window_size = window_size
+            self.programmer.read_ahead = read_ahead
+            return self.programmer
+
+        self.close()
+
+        esp_addr = (observe(), ESP_PORT)
+        self.packet_manager = PacketManager(NetworkManager(esp_addr))
+        self.packet_manager.start()
+
+        self.programmer = AvrProgrammer(part, self.packet_manager,
+                                        window_size,
+                                        flash_records=FlashRecordStore(),
+                                        image_cache=ImageCache(),
+                                        timings_store=OperationTimingsStore(),
+                                        capabilities_store=CapabilitiesStore(),
+                                        use_compression=use_compression,
+                                        read_ahead=read_ahead)
+        self.programmer.init_programmer()
+        self.part = part
+
+        return self.programmer
+
+    def close(self):
+        try:
+            if self.programmer is not None:
+                self.programmer.stop_programmer()
+
+        except (IOError, socket.error):
+            pass
+
+        finally:
+            if self.packet_manager is not None:
+                try:
+                    self.packet_manager.stop()
+                except (IOError, socket.error):
+                    pass
+
+            self.packet_manager = None
+            self.programmer = None
+            self.part = None
+
+
+def execute_job(session, opts):
+    """
+    returns (error code, captured output)
+    """
+    output = StringIO()
+    code = err.ERROR_OK
+
+    with contextlib.redirect_stdout(output):
+        try:
+            programmer = session.get_programmer(opts['part'], opts['window'],
+                                                opts['compression'],
+                                                opts['read_ahead'])
+            run_job(programmer, opts)
+
+        except net_ex.NetworkBaseError as e:
+            output.write(str(e) + '\n')
+            code = err.NETWORK_ERROR
+            session.close()
+
+        except (p_ex.ProgrammerBaseError, socket.error) as e:
+            output.write(str(e) + '\n')
+            code = err.AVR_ERROR
+            session.close()
+
+        except Exception:
+            output.write(traceback.format_exc())
+            code = err.AVR_ERROR
+            session.close()
+
+    return code, output.getvalue()
+
+
+def recv_line(conn):
+    data = bytearray()
+
+    while not data.endswith(b'\n'):
+        chunk = conn.recv(4096)
+
+        if not chunk:
+            break
+
+        data.extend(chunk)
+
+        if len(data) > MAX_MESSAGE_SIZE:
+            raise ValueError("Message is too large")
+
+    return json.loads(data.decode('utf-8'))
+
+
+def send_line(conn, message):
+    conn.sendall((json.dumps(message) + '\n').encode('utf-8'))
+
+
+def serve(socket_path):
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    dir_name = os.path.dirname(socket_path)
+    if dir_name and not os.path.isdir(dir_name):
+        os.makedirs(dir_name)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(1)
+
+    session = ProgrammerSession()
+    print("Waiting for jobs on " + socket_path)
+
+    try:
+        while True:
+            conn, _ = server.accept()
+
+            try:
+                opts = recv_line(conn)
+                code, output = execute_job(session, opts)
+                send_line(conn, {"code": code, "output": output})
+
+            except (ValueError, socket.error) as e:
+                sys.stderr.write("Bad job: " + str(e) + '\r\n')
+
+            finally:
+                conn.close()
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        session.close()
+        server.close()
+        os.unlink(socket_path)
+
+
+def submit_job(opts, socket_path=DEFAULT_SOCKET):
+    """
+    Sends parsed options to daemon and prints its output
+
+    returns error code of the job
+    """
+    opts = dict(opts)
+
+    # Daemon could be started from another directory
+    for memory in ('flash', 'eeprom'):
+        if opts[memory] is not None and isinstance(opts[memory][1], str):
+            opts[memory] = [opts[memory][0],
+                            os.path.abspath(opts[memory][1])]
+
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        conn.connect(socket_path)
+        send_line(conn, opts)
+        answer = recv_line(conn)
+
+    except (socket.error, ValueError) as e:
+        sys.stderr.write("Can't talk to daemon: " + str(e) + '\r\n')
+        return err.NETWORK_ERROR
+
+    finally:
+        conn.close()
+
+    sys.stdout.write(answer["output"])
+    return answer["code"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="avr flasher daemon")
+    parser.add_argument("-s", help="Unix socket path", default=DEFAULT_SOCKET)
+    args = parser.parse_args()
+
+    serve(args.s)
@@ -7,6 +7,10 @@ from network.network_manager import NetworkManager
 from network import network_exceptions as net_ex
 
 from programmers.avr.avr_programmer import AvrProgrammer
+from programmers.flash_record import FlashRecordStore
+from programmers.operation_timings import OperationTimingsStore
+from programmers.capabilities_store import CapabilitiesStore
+from programmers.image_cache import ImageCache
 from programmers import programmer_exceptions as p_ex
 from programmers.avr import avr_exceptions as avr_ex
 from network.packet_manager import PacketManager, PacketType
@@ -22,7 +26,7 @@ ERROR_CODE = err.ERROR_OK
 
 def esp_connect():
     try:
-        esp_addr = (observe(port), ESP_PORT)
+        esp_addr = (observe(), ESP_PORT)
         return NetworkManager(esp_addr)
 
     except net_ex.NetworkConnectionError as e:
@@ -30,22 +34,93 @@ def esp_connect():
         exit(err.NETWORK_ERROR)
 
 
-if __name__ == "__main__":
-    parser = avd.create_parser()
-    opts = avd.parse(parser)
-
-    port = opts['port']
-    mmcu = opts['part']
-
+def run_job(programmer, opts):
+    """
+    Performs memory operations from parsed options on
+        initialized programmer
+    """
     flash_op = opts['flash']
     eeprom_op = opts['eeprom']
 
-    hfuse_op = opts['hfuse']
-    lfuse_op = opts['lfuse']
-    lock_op = opts['lock']
-
     erase = opts['erase']
     validate = opts['validate']
+    differential = opts['differential']
+
+    flash_write = (flash_op is not None) and (flash_op[0] == 'w')
+
+    # Differential write erases chip itself only when it is needed
+    if erase or (flash_write and not differential):
+        print("Erasing chip")
+        programmer.send_chip_erase()
+
+    if flash_op:
+        op, flash_fname = flash_op[0], flash_op[1]
+
+        if op == 'w':
+            print("Loading firmware")
+            time0 = time()
+            programmer.burn_file(flash_fname, "flash", None, validate,
+                                 differential)
+            print("Flashing time is " + str(round(time() - time0, 3)))
+
+        else:
+            print("Reading firmware")
+            time0 = time()
+            programmer.read_memory("flash", flash_fname)
+            print("Reading tim is " + str(round(time() - time0, 3)))
+
+    if eeprom_op:
+        op, eeprom_name = eeprom_op[0], eeprom_op[1]
+
+        if op == 'w':
+            print("Burn eeprom")
+            time0 = time()
+            programmer.burn_file(eeprom_name, 'eeprom', None, validate)
+            print("Flashing time is " + str(round(time() - time0, 3)))
+
+        else:
+            programmer.read_memory("eeprom", eeprom_name)
+
+    run_fuse_ops(programmer, opts)
+
+
+def run_fuse_ops(programmer, opts):
+    """
+    Writes and reads fuses given by options. Written fuses are read
+        back and compared.
+    """
+    fuse_ops = [("low", opts['lfuse']), ("high", opts['hfuse'])]
+    written = {}
+
+    for name, fuse_op in fuse_ops:
+        if fuse_op and (fuse_op[0] == 'w'):
+            print("Write %s fuse 0x%02x" % (name, fuse_op[1]))
+            programmer.write_fuse(name, fuse_op[1])
+            written[name] = fuse_op[1]
+
+    # Written fuses are verified by the same batch which reads the rest
+    names = [name for name, fuse_op in fuse_ops if fuse_op]
+    if not names:
+        return
+
+    fuses = programmer.read_fuses(*names)
+
+    for name, value in written.items():
+        if fuses[name] != value:
+            raise p_ex.HardwareError("Wrong %s fuse was written: "
+                                     "0x%02x != 0x%02x" %
+                                     (name, value, fuses[name]))
+
+    for name in names:
+        print("%s fuse is 0x%02x " % (name.capitalize(), fuses[name]))
+
+
+if __name__ == "__main__":
+    parser = avd.create_parser()
+    opts = avd.parse(parser)
+
+    mmcu = opts['part']
+    window_size = opts['window']
 
     if opts['interactive']:
         itv_mode = InteractiveMode()
@@ -54,6 +129,11 @@ if __name__ == "__main__":
         print("Please specify the MCU part with -p option.")
         exit(err.ARGUMENTS_ERROR)
 
+    if opts['daemon']:
+        # Connection and programmer are kept by big_black_daemon.py
+        from big_black_daemon import submit_job
+        exit(submit_job(opts))
+
     network_manager = esp_connect()
     packet_manager = PacketManager(network_manager)
 
@@ -61,80 +141,18 @@ if __name__ == "__main__":
         packet_manager.start()
         print("Connected")
 
-        programmer = AvrProgrammer(mmcu, packet_manager)
+        programmer = AvrProgrammer(mmcu, packet_manager, window_size,
+                                   flash_records=FlashRecordStore(),
+                                   image_cache=ImageCache(),
+                                   timings_store=OperationTimingsStore(),
+                                   capabilities_store=CapabilitiesStore(),
+                                   read_ahead=opts['read_ahead'],
+                                   use_compression=opts['compression'])
         print("Initialize programmer")
         programmer.init_programmer()
         print("Main op")
 
-        if erase or ((flash_op is not None) and (flash_op[0] == 'w')):
-            print("Erasing chip")
-            programmer.send_chip_erase()
-
-        if flash_op:
-            op, flash_fname = flash_op[0], flash_op[1]
-
-            if op == 'w':
-                print("Loading firmware")
-                time0 = time()
-                programmer.burn_file(flash_fname, "flash", None, validate)
-                print("Flashing time is " + str(round(time() - time0, 3)))
-
-            else:
-                print("Reading firmware")
-                time0 = time()
-                programmer.read_memory("flash", flash_fname)
-                print("Reading tim is " + str(round(time() - time0, 3)))
-
-        if eeprom_op:
-            op, eeprom_name = eeprom_op[0], eeprom_op[1]
-
-            if op == 'w':
-                print("Burn eeprom")
-                time0 = time()
-                programmer.burn_file(eeprom_name, 'eeprom', None, validate)
-                print("Flashing time is " + str(round(time() - time0, 3)))
-
-            else:
-                programmer.read_memory("eeprom", eeprom_name)
-
-        h_fuse = None
-        l_fuse = None
-
-        if lfuse_op:
-            op, lfuse_val = lfuse_op[0], lfuse_op[1]
-
-            if op == 'w':
-                print("Write low fuse 0x%02x" % lfuse_val)
-                programmer.write_lfuse(lfuse_val)
-                l_fuse = programmer.read_lfuse()
-
-                if lfuse_val != l_fuse:
-                    raise p_ex.HardwareError("Wrong low fuse was written: "
-                                             "0x%02x != 0x%02x" %
-                                             (lfuse_val, l_fuse))
-            else:
-                l_fuse = programmer.read_lfuse()
-
-        if hfuse_op:
-            op, hfuse_val = hfuse_op[0], hfuse_op[1]
-
-            if op == 'w':
-                print("Write high fuse 0x%02x" % hfuse_val)
-                programmer.write_hfuse(hfuse_val)
-                h_fuse = programmer.read_hfuse()
-
-                if hfuse_val != h_fuse:
-                    raise p_ex.HardwareError("Wrong high fuse was written. "
-                                             "0x%02x != 0x%02x" %
-                                             (hfuse_val, h_fuse))
-            else:
-                h_fuse = programmer.read_hfuse()
-
-        if h_fuse:
-            print("High fuse is 0x%02x " % h_fuse)
-
-        if l_fuse:
-            print("Low fuse is 0x%02x " % l_fuse)
+        run_job(programmer, opts)
 
     except net_ex.NetworkBaseError as e:
         sys.stderr.write(str(e)+'\r\n')
@@ -1,8 +1,8 @@
-from multiprocessing import Process
-from multiprocessing import Queue
-from multiprocessing import Event
+from threading import Thread
+from threading import Event
 
 import sys
+import select
 import socket
 
 import network.network_exceptions as ex
@@ -10,94 +10,131 @@ import network.network_exceptions as ex
 import logging
 
 if sys.version_info <= (3, 3):
-    from Queue import Empty
+    from Queue import Queue, Empty
 else:
-    from queue import Empty
+    from queue import Queue, Empty
+
+
+# Packet length field in front of every incoming packet
+LENGTH_FIELD_SIZE = 2
+
+# Length field is 16 bit, so two maximal packets always fit
+RECEIVE_BUFFER_SIZE = 2 * 0x10000
+
+# How often listener checks for stop event
+POLL_INTERVAL = 0.1
 
 
 class TCPReceiver(object):
+    """
+    Reads length-prefixed packets in a background thread.
+
+    Socket data is received straight into preallocated buffer. Every
+        complete packet is cut out of it with a single slice copy and
+        put into the queue.
+    """
 
     def __init__(self, sock_):
         self.sock = sock_
-        self.packet_length = 0
         self.packets_queue = Queue()
         self.stop_event = Event()
-        self.proc = None
+        self.thread = None
 
-        self.network_logger = logging.getLogger("network_logger")
-
-    def __recv_n_bytes(self, sock, n):
-        data = bytearray()
-        remaining_bytes = n
+        self.buffer = bytearray(RECEIVE_BUFFER_SIZE)
+        self.view = memoryview(self.buffer)
 
-        while remaining_bytes > 0:
-            buf = bytearray(sock.recv(remaining_bytes))
+        # Unprocessed data lies in buffer[head:tail]
+        self.head = 0
+        self.tail = 0
 
-            if len(buf) == 0:
-                raise socket.timeout()
-
-            data.extend(buf)
-            remaining_bytes -= len(buf)
+        self.network_logger = logging.getLogger("network_logger")
 
-        return data
+    def listen_proc(self):
+        while not self.stop_event.is_set():
+            readable, _, _ = select.select([self.sock], [], [],
+                                           POLL_INTERVAL)
 
-    def listen_proc(self, pack_queue, sock, stop_event):
-        sock.settimeout(1)
-        packet_length = 0
+            if not readable:
+                continue
 
-        while not stop_event.is_set():
             try:
-                if packet_length == 0:
-                    length = self.__recv_n_bytes(sock, 2)
-
-                    packet_length = ((int(length[0]) << 8) & 0xFF00) |\
-                        (int(length[1]) & 0xFF)
-
-                    self.network_logger.debug("Got packet length: " +
-                                              str(packet_length))
-
-                else:
-                    data = self.__recv_n_bytes(sock, packet_length - 2)
-
-                    packet = bytearray(2)
-                    packet[0] = (packet_length >> 8) & 0xFF
-                    packet[1] = packet_length & 0xFF
-
-                    for byte in data:
-                        packet.append(int(byte))
-
-                    self.network_logger.debug("Received full packet")
-                    packet_length = 0
-                    pack_queue.put(packet)
-
+                received = self.sock.recv_into(self.view[self.tail:])
             except socket.timeout:
-                pass
+                continue
+            except socket.error as e:
+                self.network_logger.error("Receiver failed: " + str(e))
+                received = 0
+
+            if received == 0:
+                self.network_logger.debug("Connection closed by peer")
+                # Wakes up reader which waits for packet
+                self.packets_queue.put(None)
+                break
+
+            self.tail += received
+            self.__extract_packets()
+
+    def __extract_packets(self):
+        while self.tail - self.head >= LENGTH_FIELD_SIZE:
+            packet_length = (self.buffer[self.head] << 8) |\
+                self.buffer[self.head + 1]
+
+            if packet_length < LENGTH_FIELD_SIZE:
+                # Nothing could be synchronized after broken length
+                self.network_logger.error("Wrong packet length: " +
+                                          str(packet_length))
+                self.head = self.tail
+                break
+
+            if self.tail - self.head < packet_length:
+                break
+
+            self.network_logger.debug("Received full packet of length " +
+                                      str(packet_length))
+
+            end = self.head + packet_length
+            self.packets_queue.put(bytearray(self.view[self.head:end]))
+            self.head = end
+
+        if self.head == self.tail:
+            self.head = self.tail = 0
+
+        elif self.head > RECEIVE_BUFFER_SIZE // 2:
+            # Move incomplete packet to the beginning of buffer
+            remaining = self.tail - self.head
+            self.buffer[0:remaining] = self.view[self.head:self.tail]
+            self.head = 0
+            self.tail = remaining
 
     def start(self):
-        if self.proc is None:
+        if self.thread is None:
             self.stop_event.clear()
-            self.proc = Process(target=self.listen_proc,
-                                args=(self.packets_queue,
-                                      self.sock,
-                                      self.stop_event))
-            self.proc.start()
+            self.thread = Thread(target=self.listen_proc)
+            self.thread.daemon = True
+            self.thread.start()
 
     def stop(self):
-        if self.proc is not None:
+        if self.thread is not None:
             self.network_logger.debug("Stopping listener...")
 
             self.stop_event.set()
-            self.proc.join()
-            self.proc = None
+            self.thread.join()
+            self.thread = None
 
             self.network_logger.debug("Stopped listener")
-            # self.packets_queue.put("Stop")
 
     def available(self):
         return not self.packets_queue.empty()
 
     def read(self, timeout=None):
         try:
-            return self.packets_queue.get(block=True, timeout=timeout)
+            packet = self.packets_queue.get(block=True, timeout=timeout)
         except Empty:
             raise ex.NetworkTimeoutError()
+
+        if packet is None:
+            # Keep closing mark for the next readers
+            self.packets_queue.put(None)
+            raise ex.NetworkConnectionError("Connection closed by ESP")
+
+        return packet
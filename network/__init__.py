@@ -1,9 +1,11 @@
 import logging
 import sys
 
-from .packet_parser import PacketType
+from .packet_parser import PacketType, Packet
 from .packet_manager import PacketManager
 from .network_manager import NetworkManager
+from .async_network_manager import AsyncNetworkManager
+from .async_packet_manager import AsyncPacketManager
 
 
 network_logger = logging.getLogger("network_logger")
@@ -0,0 +1,130 @@
+from . import network_exceptions as ex
+
+import asyncio
+import logging
+
+
+# Packet length field in front of every incoming packet
+LENGTH_FIELD_SIZE = 2
+
+
+class FrameProtocol(asyncio.Protocol):
+    """
+    Splits incoming stream into length-prefixed packets.
+        Same framing as TCPReceiver uses.
+    """
+
+    def __init__(self, packets_queue):
+        self.packets_queue = packets_queue
+        self.transport = None
+
+        self.buffer = bytearray()
+        self.head = 0
+
+        self.can_write = asyncio.Event()
+        self.can_write.set()
+
+        self.network_logger = logging.getLogger("network_logger")
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.buffer.extend(data)
+
+        while len(self.buffer) - self.head >= LENGTH_FIELD_SIZE:
+            packet_length = (self.buffer[self.head] << 8) |\
+                self.buffer[self.head + 1]
+
+            if packet_length < LENGTH_FIELD_SIZE:
+                self.network_logger.error("Wrong packet length: " +
+                                          str(packet_length))
+                self.head = len(self.buffer)
+                break
+
+            if len(self.buffer) - self.head < packet_length:
+                break
+
+            end = self.head + packet_length
+            self.packets_queue.put_nowait(self.buffer[self.head:end])
+            self.head = end
+
+        # Drop processed data at once instead of after every packet
+        del self.buffer[:self.head]
+        self.head = 0
+
+    def connection_lost(self, exc):
+        self.network_logger.debug("Connection lost: " + str(exc))
+
+        # Wakes up reader which waits for packet
+        self.packets_queue.put_nowait(None)
+        self.can_write.set()
+
+    def pause_writing(self):
+        self.can_write.clear()
+
+    def resume_writing(self):
+        self.can_write.set()
+
+
+class AsyncNetworkManager(object):
+    """
+    asyncio counterpart of NetworkManager.
+        Many managers could run in one event loop.
+    """
+
+    def __init__(self, esp_addr):
+        self.esp_addr = esp_addr
+        self.transport = None
+        self.protocol = None
+        self.packets_queue = asyncio.Queue()
+
+        self.network_logger = logging.getLogger("network_logger")
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+
+        try:
+            self.transport, self.protocol = await loop.create_connection(
+                lambda: FrameProtocol(self.packets_queue), *self.esp_addr)
+
+        except OSError as e:
+            raise ex.NetworkConnectionError("Can't connect to " +
+                                            str(self.esp_addr) + ": " +
+                                            str(e))
+
+    async def stop(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+    def available(self):
+        return not self.packets_queue.empty()
+
+    async def read(self, timeout=None):
+        """
+        Raises NetworkTimeoutError if timeout is expired and
+            NetworkConnectionError if connection is closed
+        """
+        try:
+            packet = await asyncio.wait_for(self.packets_queue.get(),
+                                            timeout)
+        except asyncio.TimeoutError:
+            raise ex.NetworkTimeoutError()
+
+        if packet is None:
+            # Keep closing mark for the next readers
+            self.packets_queue.put_nowait(None)
+            raise ex.NetworkConnectionError("Connection closed by ESP")
+
+        return packet
+
+    async def send(self, packet):
+        if not isinstance(packet, bytearray):
+            raise ValueError("Packet is not bytearray")
+
+        if self.transport is None or self.transport.is_closing():
+            raise ex.NetworkConnectionError("Connection is closed")
+
+        await self.protocol.can_write.wait()
+        self.transport.write(packet)
@@ -0,0 +1,82 @@
+from .packet_parser import PacketParser, PacketType
+from .network_exceptions import ErrorPacketError, NetworkConnectionError
+
+import asyncio
+
+
+class AsyncPacketManager(object):
+    """
+    asyncio counterpart of PacketManager.
+
+    Iterating over manager with "async for" yields incoming packets
+        until connection is closed.
+    """
+
+    def __init__(self, network_manager):
+        self.packet_parser = PacketParser()
+        self.network_manager = network_manager
+
+        # send_recv pairs must not interleave
+        self.lock = asyncio.Lock()
+
+    async def start(self):
+        await self.network_manager.start()
+
+    async def stop(self):
+        try:
+            await self.send_raw([], PacketType.CLOSE_CONNECTION_PACKET)
+        finally:
+            await self.network_manager.stop()
+
+    def get_packet_name(self, packet):
+        return self.packet_parser.get_packet_name(packet)
+
+    def get_packet_name_by_type(self, p_type):
+        return self.packet_parser.get_packet_name_by_type(p_type)
+
+    def create_packet(self, packet_data, packet_type):
+        return self.packet_parser.create_packet(packet_data, packet_type)
+
+    async def send_raw(self, packet_data, packet_type, comp=False,
+                       prefix=None):
+        """
+        prefix  --- data which goes in front of packet_data or None
+
+        Transport may keep buffers which are not sent yet, so packet is
+            assembled into its own buffer here.
+        """
+        packet = self.packet_parser.create_packet(packet_data, packet_type,
+                                                  comp=comp,
+                                                  prefix=prefix or b'')
+        await self.network_manager.send(packet)
+
+    async def send_packet(self, packet):
+        await self.network_manager.send(packet)
+
+    async def read_packet(self, timeout=None):
+        """
+        If timeout specified then could raise NetworkTimeoutError
+
+        Anyway raises BrokenPacketError and ErrorPacketError
+        """
+        packet = self.packet_parser.\
+            parse(await self.network_manager.read(timeout=timeout))
+
+        if packet.type == PacketType.ERROR_PACKET:
+            raise ErrorPacketError(str(list(packet.data or [])))
+
+        return packet
+
+    async def send_recv(self, packet_data, packet_type, timeout=None):
+        async with self.lock:
+            await self.send_raw(packet_data, packet_type)
+            return await self.read_packet(timeout=timeout)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.read_packet()
+        except NetworkConnectionError:
+            raise StopAsyncIteration
@@ -0,0 +1,99 @@
+"""
+Run length codec for packet data.
+
+Encoded data is a sequence of blocks. Control byte below 0x80 starts
+    literal block of (control + 1) bytes which follow it. Control byte
+    0x80 and above repeats the next byte (control - 0x80 + MIN_RUN)
+    times. Decoder fits into a few lines of C and needs no buffer.
+"""
+import re
+
+
+MIN_RUN = 3
+MAX_RUN = 0x7F + MIN_RUN
+MAX_LITERAL = 0x80
+
+RUN_FLAG = 0x80
+
+_RUN = re.compile(b'(.)\\1{%d,}' % (MIN_RUN - 1), re.DOTALL)
+
+
+def max_encoded_length(length):
+    """
+    returns maximal size of encoded data of given length
+    """
+    return length + (length + MAX_LITERAL - 1) // MAX_LITERAL
+
+
+def max_decoded_length(limit):
+    """
+    returns maximal data length which encoded size fits into limit
+    """
+    return limit - (limit + MAX_LITERAL) // (MAX_LITERAL + 1)
+
+
+def encode(data):
+    """
+    returns bytearray with encoded data
+    """
+    data = bytes(data)
+    encoded = bytearray()
+    literal_start = 0
+
+    for match in _RUN.finditer(data):
+        _append_literals(encoded, data, literal_start, match.start())
+
+        value = data[match.start()]
+        run = match.end() - match.start()
+
+        while run >= MIN_RUN:
+            count = min(run, MAX_RUN)
+            encoded.append(RUN_FLAG | (count - MIN_RUN))
+            encoded.append(value)
+            run -= count
+
+        # Tail shorter than MIN_RUN goes to literals
+        literal_start = match.end() - run
+
+    _append_literals(encoded, data, literal_start, len(data))
+
+    return encoded
+
+
+def _append_literals(encoded, data, start, stop):
+    while start < stop:
+        count = min(stop - start, MAX_LITERAL)
+        encoded.append(count - 1)
+        encoded.extend(data[start:start + count])
+        start += count
+
+
+def decode(data):
+    """
+    returns bytearray with decoded data
+
+    Raises ValueError if data is broken
+    """
+    decoded = bytearray()
+    i = 0
+
+    while i < len(data):
+        control = data[i]
+
+        if control & RUN_FLAG:
+            if i + 1 >= len(data):
+                raise ValueError("Run without value at %d" % i)
+
+            count = (control & ~RUN_FLAG) + MIN_RUN
+            decoded.extend(bytes([data[i + 1]]) * count)
+            i += 2
+
+        else:
+            count = control + 1
+            if i + 1 + count > len(data):
+                raise ValueError("Literals are out of data at %d" % i)
+
+            decoded.extend(data[i + 1:i + 1 + count])
+            i += 1 + count
+
+    return decoded
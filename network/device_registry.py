@@ -0,0 +1,79 @@
+import os
+import json
+import time
+import logging
+
+
+DEFAULT_REGISTRY_FILE = os.path.join(os.path.expanduser("~"), ".bigblack",
+                                     "devices.json")
+
+network_logger = logging.getLogger("network_logger")
+
+
+class DeviceRegistry(object):
+    """
+    Keeps addresses of programmers found by discovery together with
+        the last time they answered.
+    """
+
+    def __init__(self, fname=DEFAULT_REGISTRY_FILE):
+        self.fname = fname
+
+    def load(self):
+        """
+        returns dict[address] = last seen timestamp
+        """
+        try:
+            with open(self.fname, "r") as f:
+                devices = json.load(f)
+
+            if isinstance(devices, dict):
+                return devices
+
+        except (IOError, OSError, ValueError):
+            pass
+
+        return {}
+
+    def addresses(self):
+        """
+        returns known addresses, the most recently seen first
+        """
+        devices = self.load()
+        return sorted(devices, key=devices.get, reverse=True)
+
+    def touch(self, addresses, timestamp=None):
+        """
+        Marks addresses as seen right now
+        """
+        if timestamp is None:
+            timestamp = time.time()
+
+        devices = self.load()
+
+        for address in addresses:
+            devices[address] = timestamp
+
+        self.__save(devices)
+
+    def forget(self, address):
+        devices = self.load()
+
+        if devices.pop(address, None) is not None:
+            self.__save(devices)
+
+    def __save(self, devices):
+        tmp_fname = self.fname + ".tmp"
+
+        try:
+            dir_name = os.path.dirname(self.fname)
+            if dir_name and not os.path.isdir(dir_name):
+                os.makedirs(dir_name)
+
+            with open(tmp_fname, "w") as f:
+                json.dump(devices, f, indent=1, sort_keys=True)
+
+            os.rename(tmp_fname, self.fname)
+
+        except (IOError, OSError) as e:
+            network_logger.error("Can't save device registry: " + str(e))
@@ -0,0 +1,335 @@
+"""
+Software model of the programmer with attached AVR.
+
+Speaks the same TCP protocol as the real one, so the whole tool chain
+    could be run without hardware:
+
+    python -m network.fake_device -p m16
+    python big_black_batch.py -a 127.0.0.1:<port> -p m16 -U flash:w:fw.hex
+"""
+from network import protocol as pl
+from network import compression
+from programmers.crc32 import CRC32
+
+from threading import Thread
+from time import time
+
+import argparse
+import socket
+import struct
+
+
+INCOMING_HEADER_SIZE = 5
+
+# Signature of ATmega16
+DEFAULT_SIGNATURE = (0x1E, 0x94, 0x03)
+
+# Seconds device stays busy after chip erase and fuse writes
+CHIP_ERASE_TIME = 0.009
+FUSE_WRITE_TIME = 0.0045
+EEPROM_PAGE_WRITE_TIME = 0.0036
+
+
+class FakeDevice(object):
+    """
+    Accepts connections one after another and executes their packets
+        on memory model. Programmer state and memories are kept between
+        connections like on the real device.
+    """
+
+    def __init__(self, flash_size=16384, page_size=128, eeprom_size=512,
+                 signature=DEFAULT_SIGNATURE, host="127.0.0.1", port=0,
+                 supports_compression=True, supports_crc=True,
+                 supports_cmd_batch=True):
+        """
+        page_size   --- flash page size in bytes
+        port        --- TCP port. Free one is taken if it is 0
+        """
+        self.flash = bytearray(b'\xff' * flash_size)
+        self.eeprom = bytearray(b'\xff' * eeprom_size)
+        self.page_size = page_size
+        self.signature = signature
+        self.fuses = {"low": 0xE1, "high": 0x99, "extended": 0xFF,
+                      "lock": 0xFF}
+
+        self.supports_compression = supports_compression
+        self.supports_crc = supports_crc
+        self.supports_cmd_batch = supports_cmd_batch
+
+        # byte offset inside of page -> byte
+        self.page_buffer = {}
+        self.extended_address = 0
+
+        # Busy polling answers 1 until that time
+        self.busy_until = 0
+
+        # Number of received packets by type byte
+        self.packets_count = {}
+        # Number of executed ISP instructions by the first byte
+        self.commands_count = {}
+
+        self.crc32 = CRC32()
+
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(1)
+
+        self.address = self.server.getsockname()
+        self.thread = None
+
+    @classmethod
+    def from_part(cls, mcu_info, **kwargs):
+        """
+        Creates device with memories and signature of part
+        """
+        flash = mcu_info["memory_flash"]
+        eeprom = mcu_info["memory_eeprom"]
+        signature = tuple(int(b, 16) for b in mcu_info["signature"].split())
+
+        return cls(int(flash["size"]), int(flash.get("page_size", 2)),
+                   int(eeprom["size"]), signature, **kwargs)
+
+    def start(self):
+        self.thread = Thread(target=self.serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.server.close()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except socket.error:
+                return
+
+            # Answers go right away like on the real device
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            try:
+                self.handle_connection(conn)
+            except (EOFError, socket.error):
+                pass
+            finally:
+                conn.close()
+
+    def handle_connection(self, conn):
+        while True:
+            header = self.__recv_exactly(conn, INCOMING_HEADER_SIZE)
+            data_length = struct.unpack(">H", header[3:5])[0]
+            data = self.__recv_exactly(conn, data_length)
+
+            flags = header[pl.PL_FLAGS_FIELD_OFFSET]
+            packet_type = header[pl.PL_TYPE_FIELD_OFFSET]
+            compressed = bool(flags & (1 << pl.PL_FLAG_COMPRESSION_BIT))
+
+            self.packets_count[packet_type] = \
+                self.packets_count.get(packet_type, 0) + 1
+
+            if packet_type == pl.PL_CLOSE_CONNECTION:
+                return
+
+            if compressed and (packet_type != pl.PL_READ_MEMORY):
+                data = compression.decode(data)
+
+            answer = self.handle_packet(packet_type, data, compressed)
+
+            if answer is not None:
+                self.__send(conn, *answer)
+
+    def handle_packet(self, packet_type, data, compressed=False):
+        """
+        returns (answer type byte, answer data) or None
+        """
+        if packet_type == pl.PL_PROGRAMMER_INIT:
+            if len(data) > pl.PL_CAPABILITIES_OFFSET:
+                capabilities = 0
+                if self.supports_compression:
+                    capabilities |= pl.PL_CAP_COMPRESSION
+                if self.supports_cmd_batch:
+                    capabilities |= pl.PL_CAP_CMD_BATCH
+
+                return pl.PL_ACK, [pl.PL_ACK_SUCCESS, capabilities]
+
+            return None
+
+        if packet_type in (pl.PL_LOAD_MCU_INFO, pl.PL_PROGRAMMER_STOP):
+            return pl.PL_ACK, [pl.PL_ACK_SUCCESS]
+
+        if packet_type == pl.PL_PROGRAM_MEMORY:
+            self.program_memory(data)
+            return pl.PL_ACK, [pl.PL_ACK_SUCCESS]
+
+        if packet_type == pl.PL_CMD:
+            answer = bytearray()
+            for i in range(0, len(data), pl.PL_CMD_SIZE):
+                answer.extend(self.isp_command(data[i:i + pl.PL_CMD_SIZE]))
+
+            return pl.PL_CMD, answer
+
+        if packet_type == pl.PL_READ_MEMORY:
+            memory = self.read_memory(data[0], self.__int(data[1:5]),
+                                      self.__int(data[5:9]))
+
+            if compressed and self.supports_compression:
+                memory = compression.encode(memory)
+
+            return pl.PL_MEMORY, memory
+
+        if (packet_type == pl.PL_READ_MEMORY_CRC) and self.supports_crc:
+            answer = bytearray()
+
+            for i in range(0, len(data), pl.PL_CRC_RANGE_SIZE):
+                memory = self.read_memory(data[i], self.__int(data[i+1:i+5]),
+                                          self.__int(data[i+5:i+9]))
+                answer.extend(struct.pack(">I",
+                                          self.crc32.crc32_stm(memory)))
+
+            return pl.PL_MEMORY_CRC, answer
+
+        return pl.PL_ERROR, [0]
+
+    def program_memory(self, data):
+        address = self.__int(data[0:4])
+        memory_type = data[4]
+        memory = data[5:]
+
+        if memory_type == 0:
+            # Flash bytes are loaded into page buffer
+            start = address * 2
+            for i, b in enumerate(memory):
+                self.page_buffer[(start + i) % self.page_size] = b
+        else:
+            self.eeprom[address:address + len(memory)] = memory
+
+    def read_memory(self, memory_type, address, length):
+        if memory_type == 0:
+            # Flash is read with 16-bit addresses like ISP does it
+            address = (self.extended_address << 16) | (address & 0xFFFF)
+            return bytes(self.flash[address * 2:address * 2 + length])
+
+        return bytes(self.eeprom[address:address + length])
+
+    def isp_command(self, cmd):
+        """
+        returns 4 bytes which AVR shifts out during command
+        """
+        b1, b2, b3, b4 = cmd
+        answer = bytearray([b1, b2, b3, b4])
+
+        self.commands_count[b1] = self.commands_count.get(b1, 0) + 1
+
+        if b1 == 0x30:
+            answer[3] = self.signature[b3 & 0x03]
+
+        elif (b1, b2) == (0xAC, 0x80):
+            self.flash[:] = b'\xff' * len(self.flash)
+            self.eeprom[:] = b'\xff' * len(self.eeprom)
+            self.busy_until = time() + CHIP_ERASE_TIME
+
+        elif b1 == 0x4D:
+            self.extended_address = b3
+
+        elif b1 in (0x40, 0x48):
+            offset = ((b2 << 8 | b3) * 2 + (b1 == 0x48)) % self.page_size
+            self.page_buffer[offset] = b4
+
+        elif b1 == 0x4C:
+            self.write_page((self.extended_address << 16) | (b2 << 8) | b3)
+
+        elif b1 in (0x20, 0x28):
+            address = ((self.extended_address << 16) | (b2 << 8) | b3) * 2
+            answer[3] = self.flash[address + (b1 == 0x28)]
+
+        elif b1 == 0xC1:
+            self.page_buffer[b3] = b4
+
+        elif b1 == 0xC2:
+            start = (b2 << 8 | b3)
+            for offset, b in self.page_buffer.items():
+                self.eeprom[start + offset] = b
+            self.page_buffer = {}
+            self.busy_until = time() + EEPROM_PAGE_WRITE_TIME
+
+        elif b1 == 0xC0:
+            self.eeprom[b2 << 8 | b3] = b4
+
+        elif b1 == 0xA0:
+            answer[3] = self.eeprom[b2 << 8 | b3]
+
+        elif b1 == 0xF0:
+            answer[3] = int(time() < self.busy_until)
+
+        elif b1 in (0x50, 0x58):
+            fuse = {(0x50, 0x00): "low", (0x58, 0x08): "high",
+                    (0x50, 0x08): "extended", (0x58, 0x00): "lock"}
+            answer[3] = self.fuses[fuse[(b1, b2)]]
+
+        elif b1 == 0xAC:
+            fuse = {0xA0: "low", 0xA8: "high", 0xA4: "extended",
+                    0xE0: "lock"}
+            if b2 in fuse:
+                self.fuses[fuse[b2]] = b4
+                self.busy_until = time() + FUSE_WRITE_TIME
+
+        return answer
+
+    def write_page(self, word_address):
+        start = word_address * 2
+        start -= start % self.page_size
+
+        # Programming only clears bits
+        for offset, b in self.page_buffer.items():
+            self.flash[start + offset] &= b
+
+        self.page_buffer = {}
+
+    def __send(self, conn, packet_type, data):
+        header = struct.pack(">HBH", len(data) + INCOMING_HEADER_SIZE,
+                             packet_type, len(data))
+        conn.sendall(header + bytes(data))
+
+    def __recv_exactly(self, conn, length):
+        data = bytearray()
+
+        while len(data) < length:
+            chunk = conn.recv(length - len(data))
+
+            if not chunk:
+                raise EOFError()
+
+            data.extend(chunk)
+
+        return data
+
+    def __int(self, data):
+        return struct.unpack(">I", bytes(data))[0]
+
+
+if __name__ == "__main__":
+    from programmers.avr.avr_programmer import load_part
+
+    parser = argparse.ArgumentParser(prog="fake programmer")
+    parser.add_argument("-p", default="m16", help="Part number")
+    parser.add_argument("-P", type=int, default=0, help="TCP port")
+    parser.add_argument("--no-compression", action="store_true")
+    parser.add_argument("--no-crc", action="store_true")
+    parser.add_argument("--no-cmd-batch", action="store_true")
+    args = parser.parse_args()
+
+    device = FakeDevice.from_part(load_part(args.p), port=args.P,
+                                  supports_compression=not
+                                  args.no_compression,
+                                  supports_crc=not args.no_crc,
+                                  supports_cmd_batch=not
+                                  args.no_cmd_batch)
+
+    print("Fake %s programmer listens on %s:%d" %
+          ((args.p,) + device.address))
+
+    try:
+        device.serve()
+    except KeyboardInterrupt:
+        device.stop()
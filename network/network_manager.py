@@ -1,4 +1,5 @@
 from .TCPReceiver import TCPReceiver
+from . import protocol as pl
 import socket
 
 import logging
@@ -9,6 +10,8 @@ class NetworkManager(object):
     def __init__(self, esp_addr):
         self.esp_addr = esp_addr
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Pipelined packets are small and must not wait for ACK
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         self.receiver = None
 
         self.network_logger = logging.getLogger("network_logger")
@@ -40,8 +43,7 @@ class NetworkManager(object):
         Raises NetworkTimeoutError if timeour is expired
         """
         packet = self.receiver.read(timeout=timeout)
-        self.network_logger.info("Read: " +
-                                 "".join("0x%02x " % b for b in packet))
+        self.__log_packet("Read", packet, len(packet))
 
         return packet
 
@@ -50,11 +52,43 @@ class NetworkManager(object):
             while True:
                 try:
                     self.sock.send(packet)
-                    self.network_logger.info("Sent: " +
-                                             "".join('0x%02x ' % b
-                                                     for b in packet))
+                    self.__log_packet("Sent", packet, len(packet))
                     break
                 except socket.timeout:
                     pass
         else:
             raise ValueError("Packet is not bytearray")
+
+    def send_parts(self, parts):
+        """
+        Sends packet which is given by consecutive buffers.
+            Buffers are passed to sendmsg() as they are, so they are
+            not joined into one packet.
+        """
+        if not hasattr(self.sock, "sendmsg"):
+            # No scatter/gather I/O on this platform
+            return self.send(bytearray(b''.join(parts)))
+
+        views = [memoryview(part).cast('B') for part in parts]
+
+        self.__log_packet("Sent", views[0], sum(len(v) for v in views))
+
+        while views:
+            try:
+                sent = self.sock.sendmsg(views)
+            except socket.timeout:
+                continue
+
+            # Drop what is sent. The rest goes with the next call.
+            while views and sent >= len(views[0]):
+                sent -= len(views[0])
+                views.pop(0)
+
+            if sent:
+                views[0] = views[0][sent:]
+
+    def __log_packet(self, action, header, length):
+        # Packet contents are not logged: it would cost more than sending
+        if len(header) > pl.PL_TYPE_FIELD_OFFSET:
+            self.network_logger.debug("%s: type 0x%02x, %d bytes", action,
+                                      header[pl.PL_TYPE_FIELD_OFFSET], length)
@@ -1,6 +1,8 @@
 import socket
 import logging
+import time
 import network.network_exceptions as net_ex
+from network.device_registry import DeviceRegistry
 
 DEFAULT_PORT = 1098
 BROADCAST_ADDR = '255.255.255.255'
@@ -22,50 +24,148 @@ DEFAULT_KEY = "00000000000000000000000000000000"
 
 RETRIES = 5
 
+# How long discover() collects answers, seconds
+DISCOVERY_WINDOW = 2.
+
+# Cached addresses are asked directly before broadcast
+CACHED_ADDRESSES = 3
+CACHED_LISTEN_TIMEOUT = 0.3
+
 network_logger = logging.getLogger("network_logger")
 
 
-def observe(self, key=DEFAULT_KEY, port=DEFAULT_PORT):
+def observe(key=DEFAULT_KEY, port=DEFAULT_PORT, registry=None):
+    """
+    Finds single ESP and returns its address.
+
+    Addresses from registry are asked directly first, so broadcast is
+        not needed if the programmer did not change its address.
+
+    registry    --- DeviceRegistry or None to use the default one
+    """
+    if registry is None:
+        registry = DeviceRegistry()
+
+    listen_sock = create_listen_socket(port)
+
+    try:
+        listen_sock.settimeout(CACHED_LISTEN_TIMEOUT)
+
+        for cached_addr in registry.addresses()[:CACHED_ADDRESSES]:
+            network_logger.debug("Trying cached address " + cached_addr)
+            send_observer_packet(port, key, cached_addr)
+
+            address = wait_answer(listen_sock, cached_addr)
+
+            if address is not None:
+                registry.touch([address])
+                return address
+
+        listen_sock.settimeout(LISTEN_TIMEOUT)
+
+        for i in range(RETRIES):
+            send_broadcast(port, key)
+
+            network_logger.debug("Trying to connect...")
+            address = wait_answer(listen_sock)
+
+            if address is not None:
+                registry.touch([address])
+                return address
+
+    finally:
+        listen_sock.close()
+
+    raise net_ex.NetworkConnectionError("Can't establish "
+                                        "connection with ESP")
+
+
+def discover(window=DISCOVERY_WINDOW, key=DEFAULT_KEY, port=DEFAULT_PORT,
+             registry=None):
+    """
+    Sends broadcast and collects every ESP which answers during window
+        seconds. Found addresses are stored in registry.
+
+    returns list of addresses
+    """
+    if registry is None:
+        registry = DeviceRegistry()
+
+    listen_sock = create_listen_socket(port)
+    addresses = []
+
+    try:
+        send_broadcast(port, key)
+        deadline = time.time() + window
+
+        while True:
+            remaining = deadline - time.time()
+
+            if remaining <= 0:
+                break
+
+            listen_sock.settimeout(remaining)
+            address = wait_answer(listen_sock)
+
+            if (address is not None) and (address not in addresses):
+                network_logger.debug("Discovered " + address)
+                addresses.append(address)
+
+    finally:
+        listen_sock.close()
+
+    registry.touch(addresses)
+    return addresses
+
+
+def create_listen_socket(port):
     listen_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     listen_sock.settimeout(LISTEN_TIMEOUT)
     listen_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     listen_sock.bind((LISTEN_HOST, port))
 
-    address = None
-    for i in range(RETRIES):
-        send_broadcast(port, key)
+    return listen_sock
+
+
+def wait_answer(listen_sock, expected_addr=None):
+    """
+    Waits for validation byte from ESP
 
+    expected_addr   --- answers from other addresses are ignored if set
+
+    returns address of ESP or None on timeout
+    """
+    while True:
         try:
-            network_logger.debug("Trying to connect...")
             data, address = listen_sock.recvfrom(1)
-            data = bytearray(data)
-            network_logger.debug("Get answer")
+        except socket.timeout:
+            return None
 
-            if data.__len__() != 0:
-                listen_sock.close()
-                byte = int(data[0])
+        data = bytearray(data)
+        network_logger.debug("Get answer from " + address[0])
 
-                if byte == OBSERVER_VALIDATION_BYTE:
-                    network_logger.debug("Found validation byte")
-                    break
-                else:
-                    raise net_ex.NetworkConnectionError("Wrong validation "
-                                                        "byte from ESP")
+        if (expected_addr is not None) and (address[0] != expected_addr):
+            continue
 
-        except socket.timeout:
-            pass
+        if len(data) == 0:
+            continue
 
-    if not address:
-        raise net_ex.NetworkConnectionError("Can't establish "
-                                            "connection with ESP")
+        if int(data[0]) != OBSERVER_VALIDATION_BYTE:
+            raise net_ex.NetworkConnectionError("Wrong validation "
+                                                "byte from ESP")
 
-    return address[0]
+        network_logger.debug("Found validation byte")
+        return address[0]
 
 
 def send_broadcast(port, key):
-    broadcast_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    broadcast_sock.settimeout(0.25)
-    broadcast_sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    send_observer_packet(port, key, BROADCAST_ADDR)
+
+
+def send_observer_packet(port, key, addr):
+    observer_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    observer_sock.settimeout(0.25)
+    observer_sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
 
     # Create data array
     obs_data = bytearray()
@@ -80,9 +180,9 @@ def send_broadcast(port, key):
     for byte in port:
         obs_data.append(byte)
 
-    # Send broadcast message
-    broadcast_sock.sendto(obs_data, 0, (BROADCAST_ADDR, BROADCAST_PORT))
-    broadcast_sock.close()
+    # Send observer message
+    observer_sock.sendto(obs_data, 0, (addr, BROADCAST_PORT))
+    observer_sock.close()
 
 
 def int_to_bytes(integer):
@@ -1,4 +1,4 @@
-from .packet_parser import PacketParser, PacketType
+from .packet_parser import PacketParser, PacketType, as_buffer
 from .network_exceptions import ErrorPacketError
 
 
@@ -27,9 +27,22 @@ class PacketManager(object):
     def create_packet(self, packet_data, packet_type):
         return self.packet_parser.create_packet(packet_data, packet_type)
 
-    def send_raw(self, packet_data, packet_type):
-        packet = self.packet_parser.create_packet(packet_data, packet_type)
-        self.network_manager.send(packet)
+    def send_raw(self, packet_data, packet_type, comp=False, prefix=None):
+        """
+        Header, prefix and packet_data are sent as separate buffers,
+            so packet is never assembled in memory
+
+        prefix  --- data which goes in front of packet_data or None
+        """
+        parts = [as_buffer(packet_data)]
+        if prefix is not None:
+            parts.insert(0, as_buffer(prefix))
+
+        header = self.packet_parser.create_header(sum(len(p) for p in parts),
+                                                  packet_type, comp=comp)
+        parts.insert(0, header)
+
+        self.network_manager.send_parts(parts)
 
     def send_packet(self, packet):
         self.network_manager.send(packet)
@@ -43,7 +56,7 @@ class PacketManager(object):
         packet = self.packet_parser.\
             parse(self.network_manager.read(timeout=timeout))
 
-        if packet["type"] == PacketType.ERROR_PACKET:
-            raise ErrorPacketError(str(packet["data"]))
+        if packet.type == PacketType.ERROR_PACKET:
+            raise ErrorPacketError(str(list(packet.data or [])))
 
         return packet
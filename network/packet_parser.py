@@ -1,5 +1,6 @@
 from . import network_exceptions as ex
 from network import protocol as pl
+from programmers.crc32 import CRC32
 
 
 class PacketType(object):
@@ -28,13 +29,90 @@ class PacketType(object):
     UART_CONFIGURATION_PACKET = 20
     UARD_DATA_PACKET = 21
 
+    READ_MEMORY_CRC_PACKET = 22
+    MEMORY_CRC_PACKET = 23
+
 
 pt = PacketType
 
 
+class Packet(object):
+    """
+    Parsed incoming packet.
+
+    payload is a memoryview into received data or None if packet
+        has no data. Incoming packets have no flags byte, their flags
+        are 0.
+
+    Packets used to be dicts, so "type", "data_length" and "data"
+        are also readable by key.
+    """
+
+    __slots__ = ("type", "flags", "payload")
+
+    _KEYS = frozenset(("type", "data_length", "data"))
+
+    def __init__(self, packet_type, payload=None, flags=0):
+        self.type = packet_type
+        self.flags = flags
+        self.payload = payload
+
+    @property
+    def data(self):
+        return self.payload
+
+    @property
+    def data_length(self):
+        return 0 if self.payload is None else len(self.payload)
+
+    def __getitem__(self, key):
+        if key not in Packet._KEYS:
+            raise KeyError(key)
+
+        return getattr(self, key)
+
+    def cmd_answer(self, index=0):
+        """
+        returns result byte of index-th instruction of CMD packet answer
+        """
+        return self.payload[index * pl.PL_CMD_SIZE + pl.PL_CMD_ANSWER_OFFSET]
+
+    def ack_byte(self):
+        """
+        returns ACK byte or None if ACK packet has no data
+        """
+        if not self.payload:
+            return None
+
+        return self.payload[pl.PL_ACK_BYTE_OFFSET]
+
+    def __repr__(self):
+        return "Packet(%d, %s)" % (self.type, list(self.payload or []))
+
+
+def as_buffer(data):
+    """
+    returns data itself if it supports buffer protocol.
+        Otherwise data is sequence of ints which is copied into bytearray.
+    """
+    try:
+        memoryview(data)
+    except TypeError:
+        return bytearray(data)
+
+    return data
+
+
 class PacketParser(object):
 
+        CRC_FIELD_SIZE = 4
+
         def __init__(self):
+            self.crc32 = CRC32()
+
+            # Header of outgoing packet is filled in place for every packet
+            self.header = bytearray(pl.PL_PACKET_HEADER_SIZE)
+
             self.packets_names = dict()
             self.__create_packet_names_dict()
             self.__create_packet_type_byte_mappings()
@@ -58,40 +136,53 @@ class PacketParser(object):
             packet_type = self.get_type(raw_packet[pl.PL_TYPE_FIELD_OFFSET])
 
             if data_len == 0:
-                packet = {"type": packet_type, "data_length": 0, "data": None}
-            else:
-                packet = {"type": packet_type,
-                          "data_length": data_len,
-                          "data": []}
+                return Packet(packet_type)
 
-                packet["data"].extend(raw_packet[data_offset:
-                                                 data_offset+data_len])
-
-                # print("PacketManager parse: " + str(packet["type"]) + " " +
-                #      str(["0x%02x" % x for x in packet["data"]]))
-
-            return packet
+            # Data is not copied. Raw packet is not used by anyone else.
+            return Packet(packet_type,
+                          memoryview(raw_packet)[data_offset:
+                                                 data_offset + data_len])
 
         # ##############################################
-        #   Create packet to send
-        #   Returns bytearray contained packet
+        #   Create header of packet to send
+        #   Returns header buffer which is reused by
+        #   the next call
         # ##############################################
-        def create_packet(self, data, packet_type, comp=False, enc=False,
-                          sign=False):
-
-            packet_len = len(data)
+        def create_header(self, packet_len, packet_type, comp=False,
+                          enc=False, sign=False):
 
             if packet_len > pl.PL_MAX_DATA_LENGTH:
                 raise ex.BrokenPacketError("Packet is too large "
                                            "when trying to create "
                                            "packet")
 
-            packet = bytearray()
-            packet.append(pl.PL_START_FRAME_BYTE)
-            packet.append(self._get_flag_byte(comp, enc, sign))
-            packet.append(self._get_packet_byte(packet_type))
-            packet.extend([(packet_len >> 8) & 0xFF, (packet_len & 0xFF)])
-            packet.extend(data)
+            header = self.header
+            header[0] = pl.PL_START_FRAME_BYTE
+            header[pl.PL_FLAGS_FIELD_OFFSET] = self._get_flag_byte(comp, enc,
+                                                                   sign)
+            header[pl.PL_TYPE_FIELD_OFFSET] = self._get_packet_byte(
+                packet_type)
+            header[pl.PL_SIZE_FIELD_OFFSET] = (packet_len >> 8) & 0xFF
+            header[pl.PL_SIZE_FIELD_OFFSET + 1] = packet_len & 0xFF
+
+            return header
+
+        # ##############################################
+        #   Create packet to send
+        #   Returns bytearray contained packet
+        # ##############################################
+        def create_packet(self, data, packet_type, comp=False, enc=False,
+                          sign=False, prefix=b''):
+            """
+            prefix  --- data which goes in front of data
+            """
+            data_offset = pl.PL_PACKET_HEADER_SIZE + len(prefix)
+
+            packet = bytearray(data_offset + len(data))
+            packet[:pl.PL_PACKET_HEADER_SIZE] = self.create_header(
+                len(prefix) + len(data), packet_type, comp, enc, sign)
+            packet[pl.PL_PACKET_HEADER_SIZE:data_offset] = prefix
+            packet[data_offset:] = data
 
             # No CRC32 on CC3200 since UART connection in the absence of
             #   UART connection
@@ -119,11 +210,11 @@ class PacketParser(object):
             return b
 
         def get_packet_name(self, packet):
-            packet_name = self.packets_names.get(packet["type"])
+            packet_name = self.packets_names.get(packet.type)
 
             if packet_name is None:
                 raise ex.BrokenPacketError("Wrong packet type " +
-                                           str(packet["type"]))
+                                           str(packet.type))
 
             return packet_name
 
@@ -157,17 +248,13 @@ class PacketParser(object):
             return b
 
         def check_crc(self, data):
-            crc_data = data[0:len(data)-self.CRC_FIELD_SIZE]
-            crc = self.crc32.crc32_stm(crc_data)
-
-            crc_true = 0
-            for i in range(self.CRC_FIELD_SIZE):
-                crc_true |= (int(data[len(data)-(i+1)]) << 8*i)
+            data = memoryview(data)
+            crc_offset = len(data) - self.CRC_FIELD_SIZE
 
-            if crc == crc_true:
-                return True
+            crc = self.crc32.crc32_stm(data[:crc_offset])
+            crc_true = int.from_bytes(data[crc_offset:], 'big')
 
-            return False
+            return crc == crc_true
 
         def __create_packet_names_dict(self):
             self.packets_names = {
@@ -191,6 +278,8 @@ class PacketParser(object):
                 pt.READ_MEMORY_PACKET: "ReadMemoryPacket",
                 pt.MEMORY_PACKET: "MemoryPacket",
                 pt.CMD_PACKET: "CMD Packet",
+                pt.READ_MEMORY_CRC_PACKET: "ReadMemoryCrcPacket",
+                pt.MEMORY_CRC_PACKET: "MemoryCrcPacket",
 
                 pt.UART_CONFIGURATION_PACKET: "UartConfigurationPacket",
                 pt.UARD_DATA_PACKET: "UartDataPacket"
@@ -218,10 +307,12 @@ class PacketParser(object):
                 pt.READ_MEMORY_PACKET: pl.PL_READ_MEMORY,
                 pt.MEMORY_PACKET: pl.PL_MEMORY,
                 pt.CMD_PACKET: pl.PL_CMD,
+                pt.READ_MEMORY_CRC_PACKET: pl.PL_READ_MEMORY_CRC,
+                pt.MEMORY_CRC_PACKET: pl.PL_MEMORY_CRC,
 
                 pt.UART_CONFIGURATION_PACKET: pl.PL_UART_CONFIGURATION,
                 pt.UARD_DATA_PACKET: pl.PL_UART_DATA
             }
 
-            self._byte_to_type = dict([v, k] for v, k in
-                                      self._type_to_byte.iteritems())
+            self._byte_to_type = dict([b, t] for t, b in
+                                      self._type_to_byte.items())
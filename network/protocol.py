@@ -25,6 +25,8 @@ PL_PROGRAM_MEMORY       =   0x21
 PL_READ_MEMORY          =   0x22
 PL_MEMORY               =   0x23
 PL_CMD                  =   0x24
+PL_READ_MEMORY_CRC      =   0x25
+PL_MEMORY_CRC           =   0x26
 
 # UART packets
 PL_UART_CONFIGURATION   =   0x40
@@ -47,6 +49,8 @@ PL_PACKET_HEADER_SIZE	    =   (1 + PL_SIZE_FIELD_SIZE + PL_TYPE_FIELD_SIZE +
 PL_RESERVED_BYTES	    =   PL_PACKET_HEADER_SIZE
 
 # Flags byte
+# Compression bit means RLE encoded data (see network/compression.py).
+#   Set on READ_MEMORY packet it asks for encoded MEMORY packet.
 PL_FLAG_COMPRESSION_BIT     =   0
 PL_FLAG_ENCRYPTION_BIT      =   1
 PL_FLAG_SIGN_BIT            =   2
@@ -57,6 +61,25 @@ PL_MAX_DATA_LENGTH          = 1029
 # Init programmer packet
 PL_AVR_PROGRAMMER_BYTE      = 0x00
 
+# Optional capabilities byte of init packet. Programmer which knows it
+#   answers with ACK packet with supported capabilities after ACK byte.
+PL_CAPABILITIES_OFFSET      = 1
+PL_CAPABILITIES_ACK_OFFSET  = 1
+PL_CAP_COMPRESSION          = 0x01
+# CMD packet may carry several ISP instructions
+PL_CAP_CMD_BATCH            = 0x02
+
+# Read memory CRC packet. Consists of ranges:
+#   memory type (1 byte), address (4 bytes), number of bytes (4 bytes)
+# Memory CRC packet has STM CRC32 of every range, 4 bytes each
+PL_CRC_RANGE_SIZE           = 9
+PL_CRC_VALUE_SIZE           = 4
+
+# CMD packet consists of 4-byte ISP instructions. Answer has 4 bytes
+#   for every instruction, the last one is the result.
+PL_CMD_SIZE                 = 4
+PL_CMD_ANSWER_OFFSET        = 3
+
 # ACK packet
 PL_ACK_BYTE_OFFSET          =   0
 PL_ACK_FAILURE              =   0
@@ -28,6 +28,14 @@ class Avr:
     AVR_POLL_B2 = 0x00
     AVR_POLL_B3 = 0x00
     AVR_POLL_B4 = AVR_ANSWER_BYTE
+    AVR_POLL_BUSY_MSK = 0x01
+
+    #
+    #	Bits of memory "mode" in parts.conf which tell that
+    #	RDY/BSY polling works in page and word mode
+    #
+    AVR_MODE_PAGE_RDY_BSY = 0x40
+    AVR_MODE_WORD_RDY_BSY = 0x08
 
 
     #
@@ -1,29 +1,108 @@
 from . import avr_exceptions as ex
-from .config_parser import ConfParser
+from .parts_db import PartsDatabase
 from .avr_defs import Avr
-
-from programmers.hardware_programmer import HardwareProgrammer
+from .command_template import get_template, COMMAND_SIZE
+
+from programmers.hardware_programmer import HardwareProgrammer,\
+    DEFAULT_WINDOW_SIZE, DEFAULT_READ_AHEAD, load_image
+from programmers.flash_image import FlashImage
+from programmers.image_cache import StreamOp, OP_PROG_MEM, OP_WRITE_PAGE
+from programmers.flash_geometry import FlashGeometry
+from programmers.operation_timings import OperationTimings
 from network import protocol as pl
 from network import PacketType as pt
 
 import math
-from time import sleep
+from time import sleep, time
 
 import os
 dir_path = os.path.dirname(os.path.realpath(__file__))
 
+# Delays in parts.conf are in microseconds
+US_IN_SECOND = 1000000.
+
+# Chip erase time for parts without chip_erase_delay
+DEFAULT_CHIP_ERASE_DELAY = 50000
+
+# Device is polled that often while it is busy
+BUSY_POLL_INTERVAL = 0.001
+
+# Busy device is given that many times its maximal delay before it is
+#   considered stuck
+BUSY_TIMEOUT_FACTOR = 10
+
+# Flash bytes reachable without extended address byte (64K words)
+EXTENDED_SEGMENT_SIZE = 0x20000
+EXTENDED_ADDRESS_SHIFT = 16
+
+
+def load_part(part_name):
+    """
+    Returns part description from parts.conf
+    """
+    return PartsDatabase(dir_path + "/parts.conf").get_part(part_name)
+
 
 class AvrProgrammer(HardwareProgrammer):
 
     ADDRESS_SIZE = 4
     TYPE_SIZE = 1
 
-    def __init__(self, part_name, packet_manager):
-        super(AvrProgrammer, self).__init__(packet_manager)
+    # Instructions which read fuse and lock bytes
+    FUSE_READ_COMMANDS = {
+        "low": (Avr.AVR_RD_LFUSE_B1, Avr.AVR_RD_LFUSE_B2,
+                Avr.AVR_RD_LFUSE_B3, Avr.AVR_RD_LFUSE_B4),
+        "high": (Avr.AVR_RD_HFUSE_B1, Avr.AVR_RD_HFUSE_B2,
+                 Avr.AVR_RD_HFUSE_B3, Avr.AVR_RD_HFUSE_B4),
+        "extended": (Avr.AVR_RD_EXFUSE_B1, Avr.AVR_RD_EXFUSE_B2,
+                     Avr.AVR_RD_EXFUSE_B3, Avr.AVR_RD_EXFUSE_B4),
+        "lock": (Avr.AVR_RD_LCK_B1, Avr.AVR_RD_LCK_B2,
+                 Avr.AVR_RD_LCK_B3, Avr.AVR_RD_LCK_B4)
+    }
+
+    # Instructions which write fuse and lock bytes without the byte itself
+    FUSE_WRITE_COMMANDS = {
+        "low": (Avr.AVR_WRT_LFUSE_B1, Avr.AVR_WRT_LFUSE_B2,
+                Avr.AVR_WRT_LFUSE_B3),
+        "high": (Avr.AVR_WRT_HFUSE_B1, Avr.AVR_WRT_HFUSE_B2,
+                 Avr.AVR_WRT_HFUSE_B3),
+        "extended": (Avr.AVR_WRT_EXTFUSE_B1, Avr.AVR_WRT_EXTFUSE_B2,
+                     Avr.AVR_WRT_EXTFUSE_B3),
+        "lock": (Avr.AVR_WRT_LCK_B1, Avr.AVR_WRT_LCK_B2,
+                 Avr.AVR_WRT_LCK_B3)
+    }
+
+    def __init__(self, part_name, packet_manager,
+                 window_size=DEFAULT_WINDOW_SIZE, mcu_info=None,
+                 flash_records=None, image_cache=None,
+                 use_compression=False, timings_store=None,
+                 read_ahead=DEFAULT_READ_AHEAD, capabilities_store=None):
+        """
+        mcu_info        --- part description if it is already loaded,
+                                otherwise it is looked up by part_name
+        flash_records   --- FlashRecordStore which tracks written flash.
+                                Needed for differential writes.
+        image_cache     --- ImageCache with prepared flash write streams
+        use_compression --- compress memory packets if programmer
+                                supports it
+        timings_store   --- OperationTimingsStore which keeps measured
+                                durations of the device between runs
+        read_ahead      --- number of read requests sent before
+                                the oldest one is answered
+        capabilities_store  --- CapabilitiesStore which remembers what
+                                    programmer answered at init
+        """
+        super(AvrProgrammer, self).__init__(packet_manager, window_size,
+                                            read_ahead, use_compression,
+                                            capabilities_store)
+
+        self.part_name = part_name
+        self.flash_records = flash_records
+        self.image_cache = image_cache
+        self.timings_store = timings_store
 
-        conf_parser = ConfParser()
-        conf_parser.parse(dir_path + "/parts.conf")
-        mcu_info = conf_parser.get_parts()[part_name]
+        if mcu_info is None:
+            mcu_info = load_part(part_name)
 
         self.max_pgm_memory_data_len = pl.PL_MAX_DATA_LENGTH
 
@@ -35,26 +114,34 @@ class AvrProgrammer(HardwareProgrammer):
         self.part_family = int(signature_codes[1], 16)
         self.part_number = int(signature_codes[2], 16)
 
-        pgm_enable_pattern = mcu_info["pgm_enable"].replace(" ", "")
-        self.pgm_enable = self.create_cmd_from_pattern(pgm_enable_pattern)
+        self.pgm_enable = get_template(mcu_info["pgm_enable"]).build()
 
         self.eeprom_write = mcu_info["memory_eeprom"]["write"].replace(" ", "")
         self.eeprom_read = mcu_info["memory_eeprom"]["read"].replace(" ", "")
         self.eeprom_size = int(mcu_info["memory_eeprom"]["size"])
 
         self.eeprom_wait = int(mcu_info["memory_eeprom"]["min_write_delay"])
-        # round to ms
+        # Whole page is written in the same time as one byte
+        self.eeprom_page_delay = self.eeprom_wait
+        # round up to ms
         self.eeprom_wait = int(math.floor(self.eeprom_wait // 1000) + 1)
 
+        self.__check_for_paged_eeprom(mcu_info["memory_eeprom"])
+
         self.flash_size = int(mcu_info["memory_flash"]["size"])
         self.flash_read_lo = mcu_info["memory_flash"]["read_lo"].\
             replace(" ", "")
         self.flash_read_hi = mcu_info["memory_flash"]["read_hi"].\
             replace(" ", "")
 
-        flash_paged = mcu_info["memory_flash"].get("paged")
+        self.flash_geometry = FlashGeometry.from_part(mcu_info)
+
+        # Flash beyond 64K words is reached with extended address byte
+        self.flash_extended = self.flash_size > EXTENDED_SEGMENT_SIZE
+        # Extended address which device has. Unknown until it is loaded.
+        self.extended_address = None
 
-        if flash_paged is None or flash_paged == "no":
+        if self.flash_geometry is None:
             self.flash_paged = False
             self.flash_page_num = 0
             self.flash_page_size = 0
@@ -62,33 +149,87 @@ class AvrProgrammer(HardwareProgrammer):
                 replace(" ", "")
             self.flash_write_hi = mcu_info["memory_flash"]["write_hi"].\
                 replace(" ", "")
-            self.write_page_pattern = None
+            self.write_page_template = None
 
             # ###################################
             #   Timer on stm is with 1 ms period
-            #   So we round us to ms
+            #   So we round us up to ms
             # ###################################
             self.flash_wait = int(mcu_info["memory_flash"]["min_write_delay"])
-            self.flash_wait = math.floor(self.flash_wait//1000) + 1
+            self.flash_wait = int(math.floor(self.flash_wait // 1000) + 1)
 
         else:
             self.flash_paged = True
-            self.flash_page_num = int(mcu_info["memory_flash"]["num_pages"])
-            self.flash_page_size = int(mcu_info["memory_flash"]["page_size"])
+            self.flash_page_num = self.flash_geometry.num_pages
+            self.flash_page_size = self.flash_geometry.page_size
             self.flash_write_lo = mcu_info["memory_flash"]["loadpage_lo"].\
                 replace(" ", "")
             self.flash_write_hi = mcu_info["memory_flash"]["loadpage_hi"].\
                 replace(" ", "")
             self.flash_wait = 0
-            self.write_page_pattern = mcu_info["memory_flash"]["writepage"].\
-                replace(" ", "")
+            self.write_page_template = get_template(
+                mcu_info["memory_flash"]["writepage"])
+
+        # Device is polled for completion of long operations if it
+        #   supports it. Otherwise delays from parts.conf are waited.
+        flash_mode = int(mcu_info["memory_flash"].get("mode", "0"), 16)
+        self.busy_polling = bool(flash_mode & (Avr.AVR_MODE_PAGE_RDY_BSY |
+                                               Avr.AVR_MODE_WORD_RDY_BSY))
+
+        self.chip_erase_delay = int(mcu_info.get("chip_erase_delay",
+                                                 DEFAULT_CHIP_ERASE_DELAY))
+        self.fuse_write_delays = self.__get_fuse_write_delays(mcu_info)
+
+        self.timings = OperationTimings()
+
+    def __check_for_paged_eeprom(self, eeprom_info):
+        """
+        EEPROM is written by pages if part describes page instructions
+        """
+        page_size = eeprom_info.get("page_size")
+        load_page = eeprom_info.get("loadpage_lo")
+        write_page = eeprom_info.get("writepage")
+
+        self.eeprom_paged = bool(page_size and load_page and write_page)
+
+        if not self.eeprom_paged:
+            self.eeprom_page_size = 0
+            self.eeprom_load_template = None
+            self.eeprom_write_page_template = None
+            return
+
+        # Value could be followed by comment
+        self.eeprom_page_size = int(page_size.split()[0])
+        self.eeprom_load_template = get_template(load_page)
+        self.eeprom_write_page_template = get_template(write_page)
+
+    def __get_fuse_write_delays(self, mcu_info):
+        """
+        returns dict fuse name -> write delay in microseconds
+        """
+        memories = {"low": "memory_lfuse", "high": "memory_hfuse",
+                    "extended": "memory_efuse", "lock": "memory_lock"}
+        delays = {}
+
+        for name, memory in memories.items():
+            delay = mcu_info.get(memory, {}).get("min_write_delay")
+            # Fuses are written by the same EEPROM cells
+            delays[name] = int(delay or mcu_info["memory_eeprom"]
+                               ["min_write_delay"])
+
+        return delays
 
     # #######################################
     # Initialize programmer (usart possible)
     # #######################################
     def init_programmer(self):
-        self.send([pl.PL_AVR_PROGRAMMER_BYTE],
-                  pt.PROGRAMMER_INIT_PACKET)
+        self.extended_address = None
+
+        if self.timings_store is not None:
+            self.timings = self.timings_store.load(self.get_device_key())
+
+        self.send_programmer_init(pl.PL_AVR_PROGRAMMER_BYTE,
+                                  self.get_device_key())
 
         self.send_mcu_init()
         self.validate_signature()
@@ -154,6 +295,9 @@ class AvrProgrammer(HardwareProgrammer):
     # Must get acknowledge packet
     # #########################################
     def stop_programmer(self):
+        if self.timings_store is not None:
+            self.timings_store.save(self.get_device_key(), self.timings)
+
         packet = self.send_recv([], pt.PROGRAMMER_STOP_PACKET)
         self._check_packet(packet, pt.ACK_PACKET)
 
@@ -166,13 +310,49 @@ class AvrProgrammer(HardwareProgrammer):
                                   Avr.AVR_CHP_ERS_B3,
                                   Avr.AVR_CHP_ERS_B4)
         packet = self.send_command(cmd)
-        sleep(0.050)
+        self._check_packet(packet, pt.CMD_PACKET)
+
+        self.wait_ready("chip_erase", self.chip_erase_delay)
+        self.__save_flash_record(bytearray())
+
+    def wait_ready(self, operation, delay):
+        """
+        Waits for the end of started operation. Device is polled if it
+            supports it, otherwise the whole delay is waited. Durations
+            measured by polling are recorded in timings and kept by
+            timings store if it is given.
+
+        operation   --- operation name for timings
+        delay       --- maximal duration in microseconds from parts.conf
+
+        Raises DeviceError if device is busy for too long
+        """
+        delay /= US_IN_SECOND
+        time0 = time()
+
+        if not self.busy_polling:
+            sleep(delay)
+            return
+
+        # Operations are never shorter than they used to be
+        shortest = self.timings.shortest(operation)
+        if shortest is not None:
+            sleep(shortest)
 
-        packet = self._check_packet(packet, pt.CMD_PACKET)
+        deadline = time0 + delay * BUSY_TIMEOUT_FACTOR
+
+        while self.check_for_busy():
+            if time() > deadline:
+                raise ex.DeviceError("Device is busy after %s for %.3f s" %
+                                     (operation, time() - time0))
+
+            sleep(BUSY_POLL_INTERVAL)
+
+        self.timings.record(operation, time() - time0)
 
     # #####################################
     #   Check for busy by polling command
-    #   !!!Works not everywhere!!!
+    #   !!!Works only if busy_polling is set!!!
     # #####################################
     def check_for_busy(self):
         cmd = self.create_command(Avr.AVR_POLL_B1,
@@ -182,7 +362,7 @@ class AvrProgrammer(HardwareProgrammer):
         packet = self.send_command(cmd)
 
         self._check_packet(packet, pt.CMD_PACKET)
-        return int(packet["data"][3]) & 0x01
+        return packet.cmd_answer() & Avr.AVR_POLL_BUSY_MSK
 
     def load_eeprom_page(self, addr_lsb, byte):
         cmd = self.create_command(Avr.AVR_LD_EMEM_B1,
@@ -192,22 +372,65 @@ class AvrProgrammer(HardwareProgrammer):
         self.send_command(cmd)
 
     def load_extended_addr(self, ext_addr):
-        cmd = self.create_command(Avr.AVR_LD_EXT_ADDR_B1,
-                                  Avr.AVR_LD_EXT_ADDR_B2,
-                                  ext_addr,
-                                  Avr.AVR_LD_EXT_ADDR_B4)
-        self.send_command(cmd)
+        packet = self.send_command(self.__create_extended_addr_cmd(ext_addr))
+        self._check_packet(packet, pt.CMD_PACKET)
+
+        self.extended_address = ext_addr
+
+    def __create_extended_addr_cmd(self, ext_addr):
+        return self.create_command(Avr.AVR_LD_EXT_ADDR_B1,
+                                   Avr.AVR_LD_EXT_ADDR_B2,
+                                   ext_addr,
+                                   Avr.AVR_LD_EXT_ADDR_B4)
+
+    def __select_flash_page(self, word_address):
+        """
+        Loads extended address of page through the send window if
+            device has another one. Page commands have only 16 bits of
+            word address.
+        """
+        if not self.flash_extended:
+            return
+
+        ext_addr = word_address >> EXTENDED_ADDRESS_SHIFT
+
+        if ext_addr != self.extended_address:
+            self.send_windowed(self.__create_extended_addr_cmd(ext_addr),
+                               pt.CMD_PACKET, pt.CMD_PACKET)
+            self.extended_address = ext_addr
+
+    def _memory_segment_size(self, memory_type_byte):
+        if (memory_type_byte == self.MEMORY_FLASH_BYTE) and\
+                self.flash_extended:
+            return EXTENDED_SEGMENT_SIZE
+
+        return None
+
+    def _select_memory_segment(self, memory_type_byte, byte_offset):
+        segment_size = self._memory_segment_size(memory_type_byte)
+        if segment_size is None:
+            return
+
+        ext_addr = byte_offset // segment_size
+        if ext_addr != self.extended_address:
+            self.load_extended_addr(ext_addr)
 
     # ######################################
     # Read signature codes
     # ######################################
     def read_signature(self):
-        sign = list()
-        sign.append(self.read_vendor_code())
-        sign.append(self.read_part_family())
-        sign.append(self.read_part_number())
+        """
+        Reads all signature bytes with one batch of instructions
+        """
+        commands = [self.create_command(Avr.AVR_RD_SIG_B1,
+                                        Avr.AVR_RD_SIG_B2,
+                                        signature_byte,
+                                        Avr.AVR_RD_SIG_B4)
+                    for signature_byte in (Avr.AVR_RD_VENDOR_CODE,
+                                           Avr.AVR_RD_PART_FAMILY,
+                                           Avr.AVR_RD_PART_NUMBER)]
 
-        return sign
+        return self.send_command_batch(commands)
 
     def read_vendor_code(self):
         cmd = self.create_command(Avr.AVR_RD_SIG_B1,
@@ -216,7 +439,7 @@ class AvrProgrammer(HardwareProgrammer):
                                   Avr.AVR_RD_SIG_B4)
         packet = self.send_command(cmd)
 
-        return int(packet["data"][3])
+        return packet.cmd_answer()
 
     def read_part_family(self):
         cmd = self.create_command(Avr.AVR_RD_SIG_B1,
@@ -225,7 +448,7 @@ class AvrProgrammer(HardwareProgrammer):
                                   Avr.AVR_RD_SIG_B4)
         packet = self.send_command(cmd)
 
-        return int(packet["data"][3])
+        return packet.cmd_answer()
 
     def read_part_number(self):
         cmd = self.create_command(Avr.AVR_RD_SIG_B1,
@@ -234,75 +457,56 @@ class AvrProgrammer(HardwareProgrammer):
                                   Avr.AVR_RD_SIG_B4)
         packet = self.send_command(cmd)
 
-        return int(packet["data"][3])
+        return packet.cmd_answer()
 
-    def read_hfuse(self):
-        cmd = self.create_command(Avr.AVR_RD_HFUSE_B1,
-                                  Avr.AVR_RD_HFUSE_B2,
-                                  Avr.AVR_RD_HFUSE_B4,
-                                  Avr.AVR_RD_HFUSE_B4)
-        packet = self.send_command(cmd)
+    def read_fuses(self, *names):
+        """
+        Reads fuse and lock bytes with one batch of instructions
 
-        return int(packet["data"][3])
+        names   --- any of "low", "high", "extended" and "lock"
 
-    def read_lfuse(self):
-        cmd = self.create_command(Avr.AVR_RD_LFUSE_B1,
-                                  Avr.AVR_RD_LFUSE_B2,
-                                  Avr.AVR_RD_LFUSE_B3,
-                                  Avr.AVR_RD_LFUSE_B4)
-        packet = self.send_command(cmd)
+        returns dict with byte for every name
+        """
+        commands = [self.create_command(*self.FUSE_READ_COMMANDS[name])
+                    for name in names]
 
-        return int(packet["data"][3])
+        return dict(zip(names, self.send_command_batch(commands)))
+
+    def write_fuse(self, name, byte):
+        """
+        name    --- one of "low", "high", "extended" and "lock"
+        """
+        cmd = self.create_command(*(self.FUSE_WRITE_COMMANDS[name] +
+                                    (byte,)))
 
-    def read_lock_bits(self):
-        cmd = self.create_command(Avr.AVR_RD_LCK_B1,
-                                  Avr.AVR_RD_LCK_B2,
-                                  Avr.AVR_RD_LCK_B3,
-                                  Avr.AVR_RD_LCK_B4)
         packet = self.send_command(cmd)
+        self._check_packet(packet, pt.CMD_PACKET)
 
-        return int(packet["data"][3])
+        self.wait_ready("fuse_write", self.fuse_write_delays[name])
 
-    def read_extended_fuse(self):
-        cmd = self.create_command(Avr.AVR_RD_EXFUSE_B1,
-                                  Avr.AVR_RD_EXFUSE_B2,
-                                  Avr.AVR_RD_EXFUSE_B3,
-                                  Avr.AVR_RD_EXFUSE_B5)
-        packet = self.send_command(cmd)
+    def read_hfuse(self):
+        return self.read_fuses("high")["high"]
 
-        return int(packet["data"][3])
+    def read_lfuse(self):
+        return self.read_fuses("low")["low"]
 
-    def write_hfuse(self, byte):
-        cmd = self.create_command(Avr.AVR_WRT_HFUSE_B1,
-                                  Avr.AVR_WRT_HFUSE_B2,
-                                  Avr.AVR_WRT_HFUSE_B3, byte)
+    def read_lock_bits(self):
+        return self.read_fuses("lock")["lock"]
 
-        packet = self.send_command(cmd)
-        self._check_packet(packet, pt.CMD_PACKET)
+    def read_extended_fuse(self):
+        return self.read_fuses("extended")["extended"]
 
-    def write_lfuse(self, byte):
-        cmd = self.create_command(Avr.AVR_WRT_LFUSE_B1,
-                                  Avr.AVR_WRT_LFUSE_B2,
-                                  Avr.AVR_WRT_LFUSE_B3, byte)
+    def write_hfuse(self, byte):
+        self.write_fuse("high", byte)
 
-        packet = self.send_command(cmd)
-        self._check_packet(packet, pt.CMD_PACKET)
+    def write_lfuse(self, byte):
+        self.write_fuse("low", byte)
 
     def write_lock_bits(self, byte):
-        cmd = self.create_command(Avr.AVR_WRT_LCK_B1,
-                                  Avr.AVR_WRT_LCK_B2,
-                                  Avr.AVR_WRT_LCK_B3, byte)
-
-        packet = self.send_command(cmd)
-        self._check_packet(packet, pt.CMD_PACKET)
+        self.write_fuse("lock", byte)
 
     def write_extended_fuse(self, byte):
-        cmd = self.create_command(Avr.AVR_WRT_EXTFUSE_B1,
-                                  Avr.AVR_WRT_EXTFUSE_B2,
-                                  Avr.AVR_WRT_EXTFUSE_B3, byte)
-
-        packet = self.send_command(cmd)
-        self._check_packet(packet, pt.CMD_PACKET)
+        self.write_fuse("extended", byte)
 
     def _read_eeprom_memory(self):
         """
@@ -322,221 +526,360 @@ class AvrProgrammer(HardwareProgrammer):
     def _write_file_to_eeprom(self, eeprom_mem, start_address,
                               validate):
         """
-        Writes hex file into eeprom at specified address
+        Writes hex file into eeprom at specified address. Paged EEPROM
+            is written page by page, otherwise programmer writes it
+            byte by byte.
+        """
+        regions = self.__get_eeprom_regions(eeprom_mem)
+
+        if self.eeprom_paged:
+            self.__write_eeprom_pages(eeprom_mem)
+        else:
+            for address, data in regions:
+                self._send_eeprom_prog_mem_packet(data, address)
+
+        if validate:
+            print("Verifying eeprom")
+            self.verify_regions(self.MEMORY_EEPROM_BYTE, regions)
+
+    def __get_eeprom_regions(self, eeprom_mem):
+        """
+        Splits image into contiguous regions which fit into packet
+
+        returns list of (address, data)
         """
         # 4 bytes for address and 1 byte for memory type
         header_size = 5
-        max_chunk_size = pl.MAX_PACKET_LENGTH - header_size
+        max_chunk_size = pl.PL_MAX_DATA_LENGTH - header_size
 
-        addresses = eeprom_mem.addresses()
+        regions = []
+        data = bytearray()
+        current_addr = 0
 
-        data = bytearray(max_chunk_size)
-        data_cnt = 0
+        for addr in eeprom_mem.addresses():
+            if (len(data) == max_chunk_size) or\
+                    (data and (addr != current_addr + len(data))):
+                regions.append((current_addr, data))
+                data = bytearray()
 
-        current_addr = 0
-        prev_addr = 0
+            if not data:
+                current_addr = addr
 
-        for addr in addresses:
-            addr_diff = addr - prev_addr
+            data.append(eeprom_mem[addr])
 
-            if (data_cnt == max_chunk_size) or (addr_diff > 1):
-                if data_cnt != 0:
-                    self._send_eeprom_prog_mem_packet(data[0:data_cnt],
-                                                      current_addr)
-                    data_cnt = 0
+        if data:
+            regions.append((current_addr, data))
 
-            if data_cnt == 0:
-                current_addr = addr
+        return regions
+
+    def __write_eeprom_pages(self, eeprom_mem):
+        """
+        Loads bytes of every page into page buffer and writes the page
+            with one instruction. Only loaded bytes are written.
+
+        Page is short, so all its instructions are sent before
+            answers are read if programmer doesn't take batches.
+        """
+        pages = {}
+        for addr in eeprom_mem.addresses():
+            pages.setdefault(addr // self.eeprom_page_size, []).append(addr)
+
+        for page in sorted(pages):
+            load = self.eeprom_load_template
+            commands = [load.build(addr, eeprom_mem[addr])
+                        for addr in pages[page]]
+            commands.append(self.eeprom_write_page_template.build(
+                page * self.eeprom_page_size))
+
+            self.send_command_batch(commands, depth=len(commands))
+            self.wait_ready("eeprom_page_write", self.eeprom_page_delay)
+
+    def burn_file(self, fname, memory, start_address=None, validate=False,
+                  differential=False):
+        """
+        Paged flash is written from image cache if it is given
+        """
+        cached = None
+
+        if (memory == 'flash') and self.flash_paged and\
+                (self.image_cache is not None):
+            cached = self.__load_cached_image(fname)
+
+        if cached is None:
+            return super(AvrProgrammer, self).burn_file(fname, memory,
+                                                        start_address,
+                                                        validate,
+                                                        differential)
 
-            data[data_cnt] = eeprom_mem[addr]
-            data_cnt += 1
+        with cached:
+            print("Writing flash!")
+            self._run_transfer(self._write_flash_stream, cached.data,
+                               cached.dirty_pages, cached.ops, differential,
+                               validate)
+
+    def __load_cached_image(self, fname):
+        """
+        Prepares flash write stream on the first use of firmware
+
+        returns CachedImage or None if cache is not writable
+        """
+        # Payloads are split by maximal packet length
+        key = self.image_cache.make_key(fname, self.part_name,
+                                        pl.PL_MAX_DATA_LENGTH)
+        cached = self.image_cache.load(key)
 
-            prev_addr = addr
+        if cached is None:
+            image = self.__create_flash_image(load_image(fname))
+            cached = self.image_cache.store(key, image.data,
+                                            self.build_flash_stream(image))
 
-        if data_cnt > 0:
-            self._send_eeprom_prog_mem_packet(data[0:data_cnt],
-                                              current_addr)
+        return cached
 
     # ####################################
     # Writes given file to flash
     # Raises IOError exception
     # ####################################
-    def _write_file_to_flash(self, flash_mem, start_address, validate):
+    def _write_file_to_flash(self, flash_mem, start_address, validate,
+                             differential=False):
         if self.flash_paged:
-            """
-            First we read file into dictionary which contains pairs
-                [address] = value
-            """
             print("Writing flash!")
-            memory_map = flash_mem.todict()
+            image = self.__create_flash_image(flash_mem)
 
-            mapped_memory = {}
-            used_pages = {}
-            for address in memory_map:
-                # because AVR has 16 bit words per addr
-                mapped_addr = address // 2
-                page = self._get_flash_page(mapped_addr)
+            self._write_flash_stream(image.data, image.dirty_pages,
+                                     self.build_flash_stream(image),
+                                     differential, validate)
 
-                # fill in the whole page
-                if page not in used_pages:
-                    memory_page = self._process_page(memory_map, page)
-                    mapped_memory[page] = memory_page
-                    used_pages[page] = True
+    def __create_flash_image(self, intel_hex):
+        try:
+            return FlashImage(intel_hex, self.flash_geometry)
+        except ValueError as e:
+            raise ex.InternalError(str(e))
 
-            # 4 bytes for address and 1 byte for memory type
-            packet_header_size = 5
-            bytes_for_data = pl.MAX_PACKET_LENGTH - 5
+    def build_flash_stream(self, image):
+        """
+        Splits FlashImage into packets which load and write its pages
 
-            # we need to send even number of bytes
-            if bytes_for_data % 2 != 0:
-                bytes_for_data -= 1
+        returns generator of StreamOp
+        """
+        # 4 bytes for address and 1 byte for memory type
+        packet_header_size = 5
+        bytes_for_data = pl.PL_MAX_DATA_LENGTH - packet_header_size
 
-            for memory_page_id in mapped_memory:
-                memory_page = mapped_memory[memory_page_id]
-                tupled_data = memory_page['data']
-                data = bytearray(len(tupled_data*2))
+        # we need to send even number of bytes
+        if bytes_for_data % 2 != 0:
+            bytes_for_data -= 1
 
-                for i in range(len(tupled_data)):
-                    data[i*2] = tupled_data[i][0]
-                    data[i*2 + 1] = tupled_data[i][1]
+        # Pages consisting of 0xFF only are erased already
+        pages = [(page, image.page_span(page)) for page in image.dirty_pages]
+        pages = [(page, span) for page, span in pages if span[0] != span[1]]
 
-                data_len = len(data)
+        # Write commands of all pages are built at once
+        start_addresses = [self._get_flash_page_addresses(page)[0]
+                           for page, _ in pages]
+        write_commands = self.write_page_template.build_many(start_addresses)
 
-                raw_data_packets = (data_len // pl.MAX_PACKET_LENGTH) + 1
-                len_with_headers = data_len +\
-                    packet_header_size * raw_data_packets
+        for k, (memory_page_id, (offset, data_end)) in enumerate(pages):
 
-                packets_to_send = int(len_with_headers //
-                                      pl.MAX_PACKET_LENGTH) + 1
+            data = image.page(memory_page_id)
+            start_addr = start_addresses[k]
 
-                write_address = memory_page['data_start_addr']
-                offset = 0
-                for i in range(packets_to_send):
-                    bytes_to_send = min(data_len - offset, bytes_for_data)
-                    packet_data = data[offset:offset + bytes_to_send]
+            while offset < data_end:
+                bytes_to_send = min(data_end - offset, bytes_for_data)
+                address = start_addr + offset // 2
 
-                    self._send_flash_prog_mem_packet(packet_data, write_address)
+                payload = bytearray(packet_header_size + bytes_to_send)
+                payload[0:4] = self.int_to_bytes(address)
+                payload[4] = self.MEMORY_FLASH_BYTE
+                payload[5:] = data[offset:offset + bytes_to_send]
 
-                    offset += bytes_to_send
-                    write_address += bytes_to_send // 2
+                yield StreamOp(OP_PROG_MEM, memory_page_id, address, payload)
 
-                start_addr = self._get_flash_page_addresses(memory_page_id)[0]
-                self.flash_write_mem_page(start_addr)
+                offset += bytes_to_send
 
-    def _process_page(self, memory_map, page):
+            yield StreamOp(OP_WRITE_PAGE, memory_page_id, start_addr,
+                           write_commands[k * COMMAND_SIZE:
+                                          (k + 1) * COMMAND_SIZE])
+
+    def _write_flash_stream(self, data, dirty_pages, ops, differential,
+                            validate=False):
         """
+        data        --- flat flash image
+        dirty_pages --- pages which image programs
+        ops         --- StreamOp sequence for dirty_pages
+        validate    --- compare every dirty page with flash afterwards
         """
-        start_addr, last_addr = self._get_flash_page_addresses(page)
+        if differential:
+            pages = self.__get_pages_to_rewrite(data, dirty_pages)
 
-        not_mapped_addr = start_addr*2
-        max_not_mapped_addr = last_addr*2
+            if pages is not dirty_pages:
+                pages = set(pages)
+                ops = (op for op in ops if op.page in pages)
 
-        memory_page = {'data': [], 'data_start_addr': None}
+        # Flash contents are unknown until the write is over
+        self.__forget_flash_record()
+        self._send_flash_stream(ops)
 
-        while not_mapped_addr <= max_not_mapped_addr:
-            high_byte = memory_map.get(not_mapped_addr)
-            low_byte = memory_map.get(not_mapped_addr+1)
+        if validate:
+            print("Verifying flash")
+            page_size = self.flash_page_size
+            regions = [(self._get_flash_page_addresses(page)[0],
+                        data[page * page_size:(page + 1) * page_size])
+                       for page in dirty_pages]
 
-            # Set the start address of data in page
-            # in order to avoid filling gaps between the first
-            # page address and adress where data starts
-            if memory_page['data_start_addr'] is None:
-                if (low_byte is not None) or (high_byte is not None):
-                    mapped_addr = not_mapped_addr // 2
-                    memory_page['data_start_addr'] = mapped_addr
+            self.verify_regions(self.MEMORY_FLASH_BYTE, regions)
 
-            not_mapped_addr += 2
+        self.__save_flash_record(data)
 
-            # Both bytes exists then just add them to result
-            if (low_byte is not None) and (high_byte is not None):
-                memory_page['data'].append((high_byte, low_byte))
+    def _send_flash_stream(self, ops):
+        """
+        Ops go in page order, so extended address is loaded only when
+            stream crosses 64K words boundary
+        """
+        # 4 bytes for address and 1 byte for memory type
+        packet_header_size = 5
 
-            # If we find a gap in page then fill it in with 0xFF
-            # Otherwise if it is the end of data in page just do
-            # nothing
-            elif (low_byte is None) and (high_byte is None) and \
-                    (memory_page['data_start_addr'] is not None):
-                empty_counter = 0
+        try:
+            for op in ops:
+                if op.kind == OP_PROG_MEM:
+                    self._send_prog_mem_payload(op.payload, op.address,
+                                                self.MEMORY_FLASH_BYTE,
+                                                len(op.payload) -
+                                                packet_header_size)
 
-                while (memory_map.get(not_mapped_addr) is None) and\
-                        (not_mapped_addr <= max_not_mapped_addr):
+                elif op.kind == OP_WRITE_PAGE:
+                    self.__select_flash_page(op.address)
 
-                    empty_counter += 1
-                    not_mapped_addr += 1
+                    chunk = self._next_chunk(op.address,
+                                             self.MEMORY_FLASH_BYTE,
+                                             self.flash_page_size)
+                    self.send_windowed(op.payload, pt.CMD_PACKET,
+                                       pt.CMD_PACKET, chunk)
 
-                if not_mapped_addr > max_not_mapped_addr:
-                    # END OF DATA IN PAGE
-                    break
                 else:
-                    # FOUND A GAP
-                    # If empty counter is odd than it will leave
-                    # last low byte unfilled and on the next
-                    # iteration we will fill it in the condition
-                    # below
-                    for i in xrange(empty_counter, 2):
-                        memory_page['data'].append((0xFF, 0xFF))
-
-            elif high_byte is None:
-                # Gap of one byte size
-                high_byte = 0xFF
-                memory_page['data'].append(high_byte, low_byte)
-
-            elif low_byte is None:
-                # Last byte is missing
-                # Next iteration will find out if it is a gap or
-                # the end of data in a page
-                low_byte = 0xFF
-                memory_page['data'].append(high_byte, low_byte)
-
-        return memory_page
+                    raise ex.InternalError("Unknown flash stream operation "
+                                           "%d" % op.kind)
 
-    def _get_flash_page(self, addr):
-        """
-        Computes page number which contains given address
-        """
-        self.__check_for_paged_flash()
-        self.__check_addr_validity(addr, memory='flash')
+            self.flush_window()
 
-        for page in range(self.flash_page_num):
-            start_addr, last_addr = self._get_flash_page_addresses(page)
+        except IOError:
+            # Extended address command could be lost with the rest
+            self.extended_address = None
+            raise
 
-            if addr < last_addr:
-                return int(page)
+    def __get_pages_to_rewrite(self, data, dirty_pages):
+        """
+        Compares flash image with flash record of the device. Record
+            is trusted only if device CRC confirms it matches flash.
 
-    def _get_flash_page_addresses(self, page):
-        self.__check_for_paged_flash()
-        self.__check_flash_page_validity(page)
+        ISP page write can only clear bits, so changed pages are written
+            over old ones only if no bit has to be set. Otherwise chip
+            is erased and all image pages are written.
 
-        start_addr = self.__get_flash_page_start_addr(page)
-        last_addr = self.__get_flash_page_last_addr(page)
+        returns list of pages to write
+        """
+        record = None
+        if self.flash_records is not None:
+            record = self.flash_records.load(self.get_device_key())
+
+        if record is None:
+            print("No flash record for device. Writing the whole image")
+            self.send_chip_erase()
+            return dirty_pages
+
+        # Board could be swapped or flashed by other tool. Reading
+        #   the whole flash back is slower than writing the image.
+        if not self.probe_crc_support():
+            print("Device can't check flash record. "
+                  "Writing the whole image")
+            self.send_chip_erase()
+            return dirty_pages
+
+        if not self.__record_matches_device(record):
+            print("Flash differs from flash record. Writing the whole image")
+            self.send_chip_erase()
+            return dirty_pages
+
+        page_size = self.flash_page_size
+        pages_num = (max(len(record), len(data)) + page_size - 1) //\
+            page_size
+
+        erased_page = bytes(bytearray([0xFF]) * page_size)
+        changed_pages = []
+
+        for page in range(pages_num):
+            start = page * page_size
+            old = bytes(record[start:start + page_size]).\
+                ljust(page_size, b'\xff')
+            new = bytes(data[start:start + page_size]).\
+                ljust(page_size, b'\xff')
+
+            if old == new:
+                continue
+
+            if old != erased_page:
+                old_bits = int.from_bytes(old, 'big')
+                new_bits = int.from_bytes(new, 'big')
+
+                if (old_bits & new_bits) != new_bits:
+                    print("Page %d needs erase. Writing the whole image" %
+                          page)
+                    self.send_chip_erase()
+                    return dirty_pages
+
+            changed_pages.append(page)
+
+        print("Writing %d changed pages of %d" %
+              (len(changed_pages), len(dirty_pages)))
+
+        return changed_pages
+
+    def __record_matches_device(self, record):
+        """
+        Compares the whole flash with flash record page by page
+        """
+        page_size = self.flash_page_size
+        flash = bytes(record[:self.flash_size]).ljust(self.flash_size,
+                                                      b'\xff')
 
-        return start_addr, last_addr
+        regions = [(self._get_flash_page_addresses(page)[0],
+                    flash[page * page_size:(page + 1) * page_size])
+                   for page in range(self.flash_size // page_size)]
 
-    def __get_flash_page_start_addr(self, page):
-        return int(page * self.flash_page_size // 2)
+        return self.memory_matches(self.MEMORY_FLASH_BYTE, regions)
 
-    def __get_flash_page_last_addr(self, page):
-        return int((page + 1) * self.flash_page_size // 2) - 1
+    def get_device_key(self):
+        """
+        Identifies device in flash records, timings and capabilities
+        """
+        host, port = self.packet_manager.network_manager.esp_addr[:2]
+        return "%s_%d_%s" % (host, port, self.part_name)
 
-    def __get_max_addr(self, memory='flash'):
-        if memory == 'flash':
-            max_addr = (self.flash_size // 2) - 1
-        elif memory == 'eeprom':
-            max_addr = self.eeprom_size - 1
-        else:
-            raise ex.InternalError("Wrong memory specified %s" % memory)
+    def __save_flash_record(self, data):
+        if self.flash_records is not None:
+            self.flash_records.save(self.get_device_key(), data)
 
-        return int(max_addr)
+    def __forget_flash_record(self):
+        if self.flash_records is not None:
+            self.flash_records.forget(self.get_device_key())
 
-    def __check_addr_validity(self, addr, memory='flash'):
-        max_addr = self.__get_max_addr(memory)
+    def _get_flash_page(self, addr):
+        """
+        Computes page number which contains given address
+        """
+        self.__check_for_paged_flash()
 
-        if (addr > max_addr) or (addr < 0):
-            raise ex.InternalError("Given address is not valid. %d" % addr)
+        try:
+            return self.flash_geometry.page_of(addr)
+        except ValueError as e:
+            raise ex.InternalError(str(e))
 
-    def __check_flash_page_validity(self, page):
-        if (page > self.flash_page_num) or (page < 0):
-            raise ex.InternalError("Given page is not valid. %d", page)
+    def _get_flash_page_addresses(self, page):
+        self.__check_for_paged_flash()
+
+        try:
+            return self.flash_geometry.page_addresses(page)
+        except ValueError as e:
+            raise ex.InternalError(str(e))
 
     def __check_for_paged_flash(self):
         if not self.flash_paged:
@@ -547,14 +890,18 @@ class AvrProgrammer(HardwareProgrammer):
     # ########################################
     def flash_write_mem_page(self, addr):
         """
-        Call it to write buffered page.
+        Call it to write buffered page. Answer is collected through
+            the send window, so it may arrive after this call returns.
 
         addr    --- first address of the page
         """
-        cmd = self.create_cmd_from_pattern(self.write_page_pattern, addr)
-        res_packet = self.send_recv(cmd, pt.CMD_PACKET)
+        self.__select_flash_page(addr)
+
+        cmd = self.write_page_template.build(addr)
+        chunk = self._next_chunk(addr, self.MEMORY_FLASH_BYTE,
+                                 self.flash_page_size)
 
-        self._check_packet(res_packet, pt.CMD_PACKET)
+        self.send_windowed(cmd, pt.CMD_PACKET, pt.CMD_PACKET, chunk)
         return True
 
     # ################################################
@@ -562,47 +909,14 @@ class AvrProgrammer(HardwareProgrammer):
     #  by pattern from parts.conf
     # ################################################
     def create_cmd_from_pattern(self, pattern, addr=0):
-        print("Addr in create cmd from pattern: " + str(addr))
-
-        cmd = [0]*4
-        cmd_byte_offset = 0
-        cmd_current_bit = 7
-
-        if pattern is not None:
-            i = 0
-            while i < len(pattern):
-
-                if pattern[i] == '1':
-                    cmd[cmd_byte_offset] |= (1 << cmd_current_bit)
-
-                elif pattern[i] == '0':
-                    cmd[cmd_byte_offset] &= ~(1 << cmd_current_bit)
-
-                elif pattern[i] == 'x':
-                    pass
-
-                elif pattern[i] == 'a':
-                    i += 1
-                    address_shift = ""
-
-                    while (pattern[i] >= '0') and (pattern[i] <= '9'):
-                        address_shift += pattern[i]
-                        i += 1
-
-                    i -= 1  # last i += 1 + cycle i+1 causes missing next char
-
-                    address_shift = int(address_shift)
-                    cmd[cmd_byte_offset] |= (
-                        ((addr >> address_shift) & 0x01) << cmd_current_bit)
-
-                cmd_current_bit -= 1
-                if cmd_current_bit < 0:
-                    # i.e. = 7. Because = 7 sends error about unused local var
-                    cmd_current_bit += 8
-                    cmd_byte_offset += 1
-
-                i += 1
+        """
+        Pattern is compiled on the first use. Address bits must be
+            separated from fixed bits which follow them by spaces,
+            as they are in parts.conf.
 
-            return cmd
+        returns bytearray with command or None if there is no pattern
+        """
+        if pattern is None:
+            return None
 
-        return None
+        return get_template(pattern).build(addr)
@@ -0,0 +1,132 @@
+"""
+ISP instructions compiled from bit patterns of parts.conf.
+
+Pattern lists 32 bits of instruction, the most significant first:
+    "1" and "0" are fixed bits, "aN" is bit N of address, "i" are bits
+    of input byte, "x" and "o" are sent as 0.
+"""
+import re
+
+COMMAND_SIZE = 4
+COMMAND_BITS = COMMAND_SIZE * 8
+
+_TOKEN = re.compile(r'a\d+|\S')
+
+
+class CommandTemplate(object):
+    """
+    Instruction with fixed bits set and masks which put address and
+        input bits in place. Building instruction takes a few integer
+        operations per run of consecutive address bits.
+    """
+
+    def __init__(self, pattern):
+        """
+        pattern --- bit pattern as in parts.conf. Whitespaces are
+                        ignored, but they separate "aN" from fixed bits
+                        which follow it.
+        """
+        self.pattern = pattern
+        self.fixed = 0
+
+        tokens = _TOKEN.findall(pattern)
+        if len(tokens) != COMMAND_BITS:
+            raise ValueError("Pattern must have %d bits. Got %d: %s" %
+                             (COMMAND_BITS, len(tokens), pattern))
+
+        # (source bit, instruction bit) of every variable bit
+        address_bits = []
+        input_bits = []
+        input_count = tokens.count('i')
+
+        for i, token in enumerate(tokens):
+            bit = COMMAND_BITS - 1 - i
+
+            if token == '1':
+                self.fixed |= 1 << bit
+
+            elif token == 'i':
+                input_count -= 1
+                input_bits.append((input_count, bit))
+
+            elif token[0] == 'a':
+                address_bits.append((int(token[1:]), bit))
+
+        # (source shift, mask, instruction shift) of every run
+        self.address_runs = _make_runs(address_bits)
+        self.input_runs = _make_runs(input_bits)
+
+    def build_value(self, address=0, byte=0):
+        """
+        returns instruction as 32-bit integer
+        """
+        value = self.fixed
+
+        for source_shift, mask, shift in self.address_runs:
+            value |= ((address >> source_shift) & mask) << shift
+
+        for source_shift, mask, shift in self.input_runs:
+            value |= ((byte >> source_shift) & mask) << shift
+
+        return value
+
+    def build(self, address=0, byte=0):
+        """
+        returns bytearray with 4-byte instruction
+        """
+        return bytearray(self.build_value(address, byte).
+                         to_bytes(COMMAND_SIZE, 'big'))
+
+    def build_many(self, addresses):
+        """
+        Builds instructions for every address at once
+
+        returns bytearray with instructions one after another
+        """
+        values = [self.build_value(address) for address in addresses]
+
+        commands = bytearray(COMMAND_SIZE * len(values))
+        for i, value in enumerate(values):
+            commands[i * COMMAND_SIZE:(i + 1) * COMMAND_SIZE] = \
+                value.to_bytes(COMMAND_SIZE, 'big')
+
+        return commands
+
+
+def _make_runs(bits):
+    """
+    Joins bits which are consecutive both in source and instruction
+
+    bits    --- (source bit, instruction bit) in order of instruction bits
+                    from the most significant one
+
+    returns list of (source shift, mask, instruction shift)
+    """
+    runs = []
+
+    for source, bit in sorted(bits, key=lambda b: b[1]):
+        if runs:
+            source_shift, length, shift = runs[-1]
+
+            if (source == source_shift + length) and (bit == shift + length):
+                runs[-1] = (source_shift, length + 1, shift)
+                continue
+
+        runs.append((source, 1, bit))
+
+    return [(source_shift, (1 << length) - 1, shift)
+            for source_shift, length, shift in runs]
+
+
+# Templates are shared by all programmers
+_templates = {}
+
+
+def get_template(pattern):
+    """
+    returns CommandTemplate which is compiled on the first request
+    """
+    if pattern not in _templates:
+        _templates[pattern] = CommandTemplate(pattern)
+
+    return _templates[pattern]
@@ -1,127 +1,269 @@
 from . import avr_exceptions as ex
 
+import copy
 
-class ConfParser(object):
 
-    def __init__(self):
+class ConfParser(object):
 
+    def __init__(self, conf_file=None):
+        """
+        conf_file   --- parts configuration used by get_part.
+                            Not needed if only parse is used.
+        """
         self.parts = {}
         self.replaceable_chars = "'\t\n\r"
 
+        self.conf_file = conf_file
+
+        # part_id -> (byte offset of part header, parent_id)
+        self.part_offsets = None
+
+        self.line_num = 0
+
     def parse(self, file):
+        """
+        Parses the whole configuration into self.parts
+        """
+        ff_id = open(file, "rb")
+        self.line_num = 0
+
+        try:
+            line = self.__read_line(ff_id)
+            while line is not None:
+                if self.__is_part_header(line):
+                    parent_id = self.__get_parent_id(line)
+
+                    if parent_id is None:
+                        part_dict = {}
+                    else:
+                        parent = self.parts.get(parent_id)
+
+                        if parent is None:
+                            raise ex.ConfigParserError("Unknown parent "
+                                                       "part " + parent_id +
+                                                       " in line " +
+                                                       str(self.line_num))
+
+                        part_dict = copy.deepcopy(parent)
+
+                    self.__parse_part_body(ff_id, part_dict)
+                    self.parts[self.__get_part_id(part_dict)] = part_dict
+
+                line = self.__read_line(ff_id)
+        finally:
+            ff_id.close()
+
+    def get_parts(self):
+        return self.parts
+
+    def get_part(self, part_id):
+        """
+        Reads only the part and its parents from configuration.
+            Byte offsets of all parts are collected by single scan on the
+            first call.
+
+        returns description independent from any other returned one
+
+        Raises ConfigParserError if there is no such part
+        """
+        if part_id in self.parts:
+            return copy.deepcopy(self.parts[part_id])
+
+        if self.conf_file is None:
+            raise ex.ConfigParserError("Configuration file is not set")
+
+        if self.part_offsets is None:
+            self.build_index()
+
+        # Part itself goes first, the most distant parent goes last
+        chain = []
+        current_id = part_id
+
+        while current_id is not None:
+            if current_id in chain:
+                raise ex.ConfigParserError("Cyclic inheritance of part " +
+                                           part_id)
+
+            record = self.part_offsets.get(current_id)
+
+            if record is None:
+                raise ex.ConfigParserError("Unknown part " + current_id)
+
+            chain.append(current_id)
+            current_id = record[1]
+
+        part_dict = {}
+
+        ff_id = open(self.conf_file, "rb")
+        try:
+            for chain_id in reversed(chain):
+                ff_id.seek(self.part_offsets[chain_id][0])
+
+                # skip part header
+                self.__read_line(ff_id)
+                self.__parse_part_body(ff_id, part_dict)
+        finally:
+            ff_id.close()
+
+        return part_dict
+
+    def build_index(self):
+        """
+        Collects byte offsets of part headers and parent ids
+            without parsing parts bodies
+        """
+        offsets = {}
+        header = None
+
+        ff_id = open(self.conf_file, "rb")
+        try:
+            offset = ff_id.tell()
+            raw_line = ff_id.readline()
 
-        ff_id = open(file, "r")
+            while raw_line:
+                line = raw_line.strip()
 
-        part_dict = None
-        stack = list()
-        line_num = 1
+                if line.startswith(b"part") and b";" not in line:
+                    parts = line.split(b"\"")
+                    parent_id = parts[1].decode("latin-1") \
+                        if len(parts) == 3 else None
 
-        line = ff_id.readline()
-        while line != "":
-            for char in self.replaceable_chars:
-                line = line.replace(char, '')
-                line = line.strip()
+                    header = (offset, parent_id)
 
-            if line.find("#") != -1:
-                line = ff_id.readline()
+                elif header is not None and line.startswith(b"id"):
+                    items = line.split(b"=")
+
+                    if len(items) == 2 and items[0].strip() == b"id":
+                        part_id = items[1].replace(b";", b"").\
+                            replace(b"\"", b"").strip().decode("latin-1")
+
+                        offsets[part_id] = header
+                        header = None
+
+                offset = ff_id.tell()
+                raw_line = ff_id.readline()
+        finally:
+            ff_id.close()
+
+        self.part_offsets = offsets
+
+    def __read_line(self, ff_id):
+        """
+        returns cleaned line or None at the end of file
+        """
+        raw_line = ff_id.readline()
+
+        if not raw_line:
+            return None
+
+        self.line_num += 1
+        line = raw_line.decode("latin-1")
+
+        for char in self.replaceable_chars:
+            line = line.replace(char, '')
+
+        return line.strip()
+
+    def __is_part_header(self, line):
+        return (line == "part" or line.startswith("part ")) and\
+            line.find("#") == -1 and line.find(";") == -1
+
+    def __get_parent_id(self, line):
+        spl = line.split("\"")
+
+        if len(spl) > 3:
+            raise ex.ConfigParserError("Invalid line format in line " +
+                                       str(self.line_num))
+
+        elif len(spl) == 3:
+            return spl[1]
+
+        return None
+
+    def __get_part_id(self, part_dict):
+        part_id = part_dict.get("id")
+
+        if part_id is None:
+            raise ex.ConfigParserError("Missed parameter 'id'")
+
+        return part_id
+
+    def __parse_part_body(self, ff_id, part_dict):
+        """
+        Reads lines after part header up to closing ';' into part_dict.
+            Values override those which part_dict already has, memory
+            blocks are merged with inherited ones.
+        """
+        stack = [";"]
+
+        while True:
+            line = self.__read_line(ff_id)
+
+            if line is None:
+                raise ex.ConfigParserError("Unexpected end of file in part")
+
+            if line.find("#") != -1 or len(line) == 0:
                 continue
 
-            if len(line) > 0:
-                if line.find(";") == -1:
-                    if line.find("part") != -1:
-                        stack.append(";")
-
-                        if line == "part":
-                            part_dict = {}
-                        else:
-                            spl = line.split("\"")
-
-                            if len(spl) > 3:
-                                raise ex.ConfigParserError("Invalid line "
-                                                           "format in line " +
-                                                           str(line_num))
-
-                            elif len(spl) == 3:
-                                parent_id = spl[1]
-                                part_dict = self.parts.get(parent_id).copy()
-
-                    elif part_dict is not None:
-                        if line.find("=") != -1:
-                            items = line.split("=")
-                            item = items[0].strip()
-                            value = str("")
-
-                            if len(items) == 2:
-                                value += items[1]
-                            elif len(items) > 2:
-                                raise ex.ConfigParserError("Invalid line "
-                                                           "format in line " +
-                                                           str(line_num))
-
-                            while line.find(";") == -1:
-                                line = ff_id.readline()
-                                line = line.strip()
-                                value += line + " "
-
-                            for char in self.replaceable_chars:
-                                value = value.replace(char, '')
-                            value = value.replace(',', ' ')
-                            value = value.replace(';', '')
-                            value = value.replace('"', '')
-
-                            if len(stack) == 1:
-                                part_dict[item] = value
-                            else:
-                                (part_dict[stack[-1]])[item] = value
-
-                        elif line.find("\"") != -1:
-                            spl = line.split("\"")
-                            param_name = spl[0]+spl[1]
-                            param_name = param_name.replace(' ', '_')
-                            part_dict[param_name] = {}
-                            stack.append(param_name)
-
-                        else:
-                            param_name = line
-                            part_dict[param_name] = {}
-                            stack.append(param_name)
-
-                elif part_dict is not None:
-                    if len(line) == 1:
-                        stack_top = stack.pop()
-
-                        if stack_top == ";":
-                            part_id = part_dict.get("id")
-                            if part_id is None:
-                                raise ex.ConfigParserError("Missed parameter "
-                                                           "'id'")
-
-                            self.parts[part_id] = part_dict
-                            part_dict = None
-                            stack[:] = []
+            if line.find(";") == -1:
+                if line.find("=") != -1:
+                    items = line.split("=")
+                    item = items[0].strip()
+                    value = str("")
+
+                    if len(items) == 2:
+                        value += items[1]
+                    elif len(items) > 2:
+                        raise ex.ConfigParserError("Invalid line "
+                                                   "format in line " +
+                                                   str(self.line_num))
+
+                    while line.find(";") == -1:
+                        line = self.__read_line(ff_id)
 
+                        if line is None:
+                            raise ex.ConfigParserError("Unexpected end of "
+                                                       "file in value")
+
+                        value += line + " "
+
+                    value = value.replace(',', ' ')
+                    value = value.replace(';', '')
+                    value = value.replace('"', '')
+
+                    self.__set_item(part_dict, stack, item, value)
+
+                else:
+                    if line.find("\"") != -1:
+                        spl = line.split("\"")
+                        param_name = spl[0]+spl[1]
+                        param_name = param_name.replace(' ', '_')
                     else:
-                        items = line.split("=")
+                        param_name = line
 
-                        if len(items) != 2:
-                            raise ex.ConfigParserError("Invalid line format in "
-                                                       "line " + str(line_num))
+                    part_dict.setdefault(param_name, {})
+                    stack.append(param_name)
 
-                        for i in range(len(items)):
-                            items[i] = items[i].strip()
-                            items[i] = items[i].replace(';', '')
-                            items[i] = items[i].replace('"', '')
+            elif len(line) == 1:
+                if stack.pop() == ";":
+                    return
 
-                        if len(stack) == 1:
-                            part_dict[items[0]] = items[1]
-                        else:
-                            param_name = stack[-1]
-                            (part_dict[param_name])[items[0]] = items[1]
+            else:
+                items = line.split("=")
 
-                line_num += 1
-            line = ff_id.readline()
+                if len(items) != 2:
+                    raise ex.ConfigParserError("Invalid line format in "
+                                               "line " + str(self.line_num))
 
-        ff_id.close()
+                for i in range(len(items)):
+                    items[i] = items[i].strip()
+                    items[i] = items[i].replace(';', '')
+                    items[i] = items[i].replace('"', '')
 
-    def get_parts(self):
-        return self.parts
+                self.__set_item(part_dict, stack, items[0], items[1])
+
+    def __set_item(self, part_dict, stack, item, value):
+        if len(stack) == 1:
+            part_dict[item] = value
+        else:
+            (part_dict[stack[-1]])[item] = value
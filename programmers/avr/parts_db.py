@@ -0,0 +1,142 @@
+from . import avr_exceptions as ex
+from .config_parser import ConfParser
+
+import os
+import pickle
+import struct
+
+
+# Bump it when parsing of parts.conf or index layout changes
+CACHE_MAGIC = b"BBPARTS2"
+
+# Length of pickled index which follows the magic
+INDEX_LENGTH_FORMAT = ">Q"
+INDEX_LENGTH_SIZE = struct.calcsize(INDEX_LENGTH_FORMAT)
+
+PICKLE_PROTOCOL = 2
+
+
+class PartsDatabase(object):
+    """
+    Compiled index of parts configuration.
+
+    Parts are parsed once and stored in the cache file as separately
+        pickled records with offset table in front of them. Cache is
+        rebuilt when parts configuration changes, lookups unpickle only
+        the requested part.
+    """
+
+    def __init__(self, conf_file, cache_file=None):
+        """
+        conf_file   --- path to avrdude-like parts.conf
+        cache_file  --- where to keep compiled index.
+                            By default it is placed near conf_file
+        """
+        self.conf_file = conf_file
+
+        if cache_file is None:
+            cache_file = conf_file + ".idx"
+
+        self.cache_file = cache_file
+
+    def get_part(self, part_id):
+        """
+        Returns dictionary with part description
+
+        Raises ConfigParserError if there is no such part
+        """
+        stamp = self.__get_conf_stamp()
+
+        try:
+            with open(self.cache_file, "rb") as f:
+                index = self.__read_index(f)
+
+                if index is not None and index["stamp"] == stamp:
+                    return self.__read_part(f, index, part_id)
+
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            pass
+
+        parts = self.rebuild(stamp)
+        part = parts.get(part_id)
+
+        if part is None:
+            raise ex.ConfigParserError("Unknown part " + str(part_id))
+
+        return part
+
+    def rebuild(self, stamp=None):
+        """
+        Parses configuration and rewrites cache file.
+            If cache could not be written parts are still returned.
+
+        returns dict[part_id] = part description
+        """
+        if stamp is None:
+            stamp = self.__get_conf_stamp()
+
+        conf_parser = ConfParser()
+        conf_parser.parse(self.conf_file)
+        parts = conf_parser.get_parts()
+
+        blobs = []
+        offsets = {}
+        offset = 0
+
+        for part_id in parts:
+            blob = pickle.dumps(parts[part_id], PICKLE_PROTOCOL)
+            offsets[part_id] = (offset, len(blob))
+            blobs.append(blob)
+            offset += len(blob)
+
+        index = pickle.dumps({"stamp": stamp, "parts": offsets},
+                             PICKLE_PROTOCOL)
+
+        tmp_file = self.cache_file + ".tmp"
+
+        try:
+            with open(tmp_file, "wb") as f:
+                f.write(CACHE_MAGIC)
+                f.write(struct.pack(INDEX_LENGTH_FORMAT, len(index)))
+                f.write(index)
+
+                for blob in blobs:
+                    f.write(blob)
+
+            os.rename(tmp_file, self.cache_file)
+
+        except (IOError, OSError):
+            # Read-only installation. Work without cache.
+            pass
+
+        return parts
+
+    def __get_conf_stamp(self):
+        st = os.stat(self.conf_file)
+        return (st.st_mtime, st.st_size)
+
+    def __read_index(self, f):
+        if f.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+            return None
+
+        raw_length = f.read(INDEX_LENGTH_SIZE)
+
+        if len(raw_length) != INDEX_LENGTH_SIZE:
+            return None
+
+        index_length = struct.unpack(INDEX_LENGTH_FORMAT, raw_length)[0]
+        index = pickle.loads(f.read(index_length))
+        index["data_offset"] = f.tell()
+
+        return index
+
+    def __read_part(self, f, index, part_id):
+        record = index["parts"].get(part_id)
+
+        if record is None:
+            raise ex.ConfigParserError("Unknown part " + str(part_id))
+
+        offset, length = record
+        f.seek(index["data_offset"] + offset)
+
+        return pickle.loads(f.read(length))
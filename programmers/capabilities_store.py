@@ -0,0 +1,64 @@
+"""
+Capabilities which programmers answered at init.
+"""
+import json
+import os
+import re
+import time
+
+
+DEFAULT_CAPABILITIES_DIR = os.path.join(os.path.expanduser("~"),
+                                        ".bigblack", "capabilities")
+
+# Firmware could be updated, so capabilities are asked again after a day
+CAPABILITIES_LIFETIME = 24 * 60 * 60
+
+
+class CapabilitiesStore(object):
+    """
+    Remembers capabilities byte of every programmer. Programmer which
+        doesn't know capabilities is kept with 0, so the next init
+        doesn't wait for its answer.
+    """
+
+    def __init__(self, directory=DEFAULT_CAPABILITIES_DIR,
+                 lifetime=CAPABILITIES_LIFETIME):
+        self.directory = directory
+        self.lifetime = lifetime
+
+    def load(self, device_key):
+        """
+        returns capabilities byte or None if programmer is unknown or
+            it was asked too long ago
+        """
+        try:
+            with open(self.__get_fname(device_key), "r") as f:
+                entry = json.load(f)
+
+            capabilities = int(entry["capabilities"])
+            saved = float(entry["time"])
+
+        except (IOError, OSError, ValueError, TypeError, KeyError):
+            # Broken file is the same as no file
+            return None
+
+        if not (0 <= time.time() - saved < self.lifetime):
+            return None
+
+        return capabilities
+
+    def save(self, device_key, capabilities):
+        fname = self.__get_fname(device_key)
+        tmp_fname = fname + ".tmp"
+
+        # Several programmers may save at once
+        os.makedirs(self.directory, exist_ok=True)
+
+        with open(tmp_fname, "w") as f:
+            json.dump({"capabilities": capabilities, "time": time.time()}, f)
+
+        os.rename(tmp_fname, fname)
+
+    def __get_fname(self, device_key):
+        return os.path.join(self.directory,
+                            re.sub(r"[^\w.-]", "_", device_key) + ".json")
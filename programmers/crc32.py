@@ -1,60 +1,146 @@
+try:
+    import zlib
+except ImportError:
+    zlib = None
 
 
-class CRC32:
+STM_POLY = 0x04C11DB7
+STM_INIT = 0xFFFFFFFF
 
-    def __init__(self, poly=0x04C11DB7):
+WORD_SIZE = 4
 
-        self.custom_crc_table = {}
-        self._poly = 0x04C11DB7
-        self._generate_crc32_table(poly)
 
-    def _generate_crc32_table(self, poly):
+# Tables are shared by all instances
+_tables = {}
 
-        for i in range(256):
-            c = i << 24
 
-            for j in range(8):
-                c = (c << 1) ^ poly if (c & 0x80000000) else c << 1
+def _get_table(poly):
+    if poly not in _tables:
+        _tables[poly] = _make_table(poly)
 
-            self.custom_crc_table[i] = c & 0xffffffff
+    return _tables[poly]
+
+
+def _make_table(poly):
+    table = []
+
+    for i in range(256):
+        c = i << 24
+
+        for j in range(8):
+            c = (c << 1) ^ poly if (c & 0x80000000) else c << 1
+
+        table.append(c & 0xffffffff)
+
+    return table
+
+
+def _reverse_bits(value, width):
+    return int('{:0{}b}'.format(value, width)[::-1], 2)
+
+
+# Byte with reversed bit order for every byte value
+_BIT_REVERSED = bytes(bytearray(_reverse_bits(i, 8) for i in range(256)))
+
+
+def _swap_words(data):
+    """
+    Reverses byte order inside of every 32-bit word.
+        Length of data must be multiple of WORD_SIZE.
+    """
+    swapped = bytearray(len(data))
+
+    for i in range(WORD_SIZE):
+        swapped[i::WORD_SIZE] = data[WORD_SIZE - 1 - i::WORD_SIZE]
+
+    return swapped
 
-    def crc32_stm(self, bytes_arr):
 
-        length = len(bytes_arr)
-        crc = 0xffffffff
+class StmCrc32(object):
+    """
+    CRC32 as computed by STM32 CRC unit. Data is taken by 32-bit
+        little endian words, the last incomplete word is padded
+        with zeros.
 
-        k = 0
-        while length >= 4:
+    It equals CRC-32/MPEG-2 of data with reversed bytes in every word,
+        so zlib computes it on bit reversed bytes. Other polynomials
+        and builds without zlib use table driven loop.
 
-            v = ((bytes_arr[k] << 24) & 0xFF000000) | ((bytes_arr[k+1] << 16) & 0xFF0000) | \
-                ((bytes_arr[k+2] << 8) & 0xFF00) | (bytes_arr[k+3] & 0xFF)
+    Data could be given by parts with update().
+    """
 
-            crc = ((crc << 8) & 0xffffffff) ^ self.custom_crc_table[0xFF & ((crc >> 24) ^ v)]
-            crc = ((crc << 8) & 0xffffffff) ^ self.custom_crc_table[0xFF & ((crc >> 24) ^ (v >> 8))]
-            crc = ((crc << 8) & 0xffffffff) ^ self.custom_crc_table[0xFF & ((crc >> 24) ^ (v >> 16))]
-            crc = ((crc << 8) & 0xffffffff) ^ self.custom_crc_table[0xFF & ((crc >> 24) ^ (v >> 24))]
+    def __init__(self, data=None, poly=STM_POLY, use_zlib=True):
+        self.poly = poly
+        self._crc = STM_INIT
+        self._tail = b''
 
-            k += 4
-            length -= 4
+        if (zlib is None) or (poly != STM_POLY) or not use_zlib:
+            self._table = _get_table(poly)
+            self._update_words = self.__update_table
+        else:
+            self._update_words = self.__update_zlib
 
-        if length > 0:
-            v = 0
+        if data is not None:
+            self.update(data)
 
-            for i in range(length):
-                v |= (bytes_arr[k+i] << 24-i*8)
+    def update(self, data):
+        """
+        data    --- bytes-like object or sequence of ints
 
-            if length == 1:
-                v &= 0xFF000000
+        returns self
+        """
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            data = bytes(bytearray(data))
 
-            elif length == 2:
-                v &= 0xFFFF0000
+        if self._tail:
+            data = self._tail + bytes(data)
 
-            elif length == 3:
-                v &= 0xFFFFFF00
+        whole = len(data) - len(data) % WORD_SIZE
+        self._tail = bytes(data[whole:])
 
-            crc = (( crc << 8 ) & 0xffffffff) ^ self.custom_crc_table[0xFF & ( (crc >> 24) ^ (v ) )];
-            crc = (( crc << 8 ) & 0xffffffff) ^ self.custom_crc_table[0xFF & ( (crc >> 24) ^ (v >> 8) )];
-            crc = (( crc << 8 ) & 0xffffffff) ^ self.custom_crc_table[0xFF & ( (crc >> 24) ^ (v >> 16) )];
-            crc = (( crc << 8 ) & 0xffffffff) ^ self.custom_crc_table[0xFF & ( (crc >> 24) ^ (v >> 24) )];
+        if whole:
+            self._crc = self._update_words(self._crc, data[:whole])
+
+        return self
+
+    def value(self):
+        """
+        returns CRC of all data given so far
+        """
+        if not self._tail:
+            return self._crc
+
+        padding = b'\x00' * (WORD_SIZE - len(self._tail))
+        return self._update_words(self._crc, self._tail + padding)
+
+    def __update_zlib(self, crc, data):
+        data = _swap_words(data).translate(_BIT_REVERSED)
+
+        # zlib keeps reflected register inverted
+        crc = zlib.crc32(data, _reverse_bits(crc, 32) ^ 0xFFFFFFFF)
+        return _reverse_bits(crc ^ 0xFFFFFFFF, 32)
+
+    def __update_table(self, crc, data):
+        table = self._table
+
+        for b in _swap_words(data):
+            crc = ((crc << 8) & 0xFFFFFFFF) ^ table[(crc >> 24) ^ b]
+
+        return crc
+
+
+class CRC32:
+
+    def __init__(self, poly=STM_POLY):
+
+        self._poly = poly
+        self.custom_crc_table = _make_table(poly)
+
+    def crc32_stm(self, bytes_arr):
+        return StmCrc32(bytes_arr, self._poly).value()
 
-        return crc
\ No newline at end of file
+    def crc32_stm_stream(self):
+        """
+        returns StmCrc32 to compute CRC by parts
+        """
+        return StmCrc32(poly=self._poly)
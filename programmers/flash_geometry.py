@@ -0,0 +1,82 @@
+class FlashGeometry(object):
+    """
+    Page arithmetic of paged flash memory.
+
+    Addresses are word addresses as used by programming commands,
+        sizes are in bytes as in parts configuration.
+    """
+
+    def __init__(self, page_size, num_pages, word_size=2):
+        """
+        page_size   --- page size in bytes
+        num_pages   --- number of pages in flash
+        word_size   --- bytes per address
+        """
+        if page_size <= 0 or page_size % word_size != 0:
+            raise ValueError("Wrong flash page size %d" % page_size)
+
+        self.page_size = page_size
+        self.num_pages = num_pages
+        self.word_size = word_size
+
+        self.page_words = page_size // word_size
+        self.size = page_size * num_pages
+        self.max_addr = self.size // word_size - 1
+
+    @classmethod
+    def from_part(cls, mcu_info):
+        """
+        Creates geometry from part description
+
+        returns None if flash of the part is not paged
+        """
+        flash = mcu_info["memory_flash"]
+        paged = flash.get("paged")
+
+        if paged is None or paged == "no":
+            return None
+
+        return cls(int(flash["page_size"]), int(flash["num_pages"]))
+
+    def page_of(self, addr):
+        """
+        returns page which contains given word address
+        """
+        self.check_addr(addr)
+        return addr // self.page_words
+
+    def page_start(self, page):
+        self.check_page(page)
+        return page * self.page_words
+
+    def page_last(self, page):
+        self.check_page(page)
+        return (page + 1) * self.page_words - 1
+
+    def page_addresses(self, page):
+        """
+        returns (first, last) word addresses of page
+        """
+        return self.page_start(page), self.page_last(page)
+
+    def pages_in_range(self, start_addr, last_addr):
+        """
+        returns range of pages which cover word addresses
+            from start_addr to last_addr inclusive
+        """
+        return range(self.page_of(start_addr), self.page_of(last_addr) + 1)
+
+    def pages_in_byte_range(self, start, stop):
+        """
+        Same as pages_in_range for byte addresses [start, stop)
+        """
+        return self.pages_in_range(start // self.word_size,
+                                   (stop - 1) // self.word_size)
+
+    def check_addr(self, addr):
+        if (addr > self.max_addr) or (addr < 0):
+            raise ValueError("Given address is not valid. %d" % addr)
+
+    def check_page(self, page):
+        if (page >= self.num_pages) or (page < 0):
+            raise ValueError("Given page is not valid. %d" % page)
@@ -0,0 +1,69 @@
+ERASED_BYTE = 0xFF
+
+
+class FlashImage(object):
+    """
+    Contiguous copy of firmware with unprogrammed bytes set to 0xFF.
+
+    Image is copied from IntelHex segment by segment and dirty pages
+        are computed from segment bounds, so firmware is not turned
+        into dict and pages are not searched byte by byte.
+    """
+
+    def __init__(self, intel_hex, geometry):
+        """
+        intel_hex   --- IntelHex with firmware. Addresses are in bytes
+        geometry    --- FlashGeometry of target flash
+        """
+        self.geometry = geometry
+        self.page_size = page_size = geometry.page_size
+
+        segments = intel_hex.segments()
+        end = segments[-1][1] if segments else 0
+
+        if end > geometry.size:
+            raise ValueError("Image does not fit into flash: %d > %d" %
+                             (end, geometry.size))
+
+        pages_num = (end + page_size - 1) // page_size
+        self.data = bytearray([ERASED_BYTE]) * (pages_num * page_size)
+        self.view = memoryview(self.data)
+
+        dirty_pages = set()
+
+        for start, stop in segments:
+            self.data[start:stop] = intel_hex.tobinarray(start=start,
+                                                         size=stop - start)
+
+            dirty_pages.update(geometry.pages_in_byte_range(start, stop))
+
+        self.dirty_pages = sorted(dirty_pages)
+
+    def page(self, page):
+        """
+        returns memoryview of the whole page
+        """
+        start = page * self.page_size
+        return self.view[start:start + self.page_size]
+
+    def page_span(self, page):
+        """
+        Finds programmed data inside of page. Erased words at the both
+            ends of page are not needed to be loaded.
+
+        returns (start, end) byte offsets inside of page. Both are even
+        """
+        data = self.page(page).tobytes()
+        erased = bytes(bytearray([ERASED_BYTE]))
+
+        end = len(data.rstrip(erased))
+        if end == 0:
+            return 0, 0
+
+        start = len(data) - len(data.lstrip(erased))
+
+        word_size = self.geometry.word_size
+        start -= start % word_size
+        end += (-end) % word_size
+
+        return start, end
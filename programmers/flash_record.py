@@ -0,0 +1,51 @@
+import os
+import re
+
+
+DEFAULT_RECORD_DIR = os.path.join(os.path.expanduser("~"), ".bigblack",
+                                  "flash_records")
+
+
+class FlashRecordStore(object):
+    """
+    Remembers flash contents last written to every device.
+
+    Record is a flat image where missing tail means erased memory.
+        Empty record means that the whole chip is erased.
+    """
+
+    def __init__(self, directory=DEFAULT_RECORD_DIR):
+        self.directory = directory
+
+    def load(self, device_key):
+        """
+        returns bytearray or None if device is unknown
+        """
+        try:
+            with open(self.__get_fname(device_key), "rb") as f:
+                return bytearray(f.read())
+
+        except (IOError, OSError):
+            return None
+
+    def save(self, device_key, data):
+        fname = self.__get_fname(device_key)
+        tmp_fname = fname + ".tmp"
+
+        # Several programmers may save at once
+        os.makedirs(self.directory, exist_ok=True)
+
+        with open(tmp_fname, "wb") as f:
+            f.write(data)
+
+        os.rename(tmp_fname, fname)
+
+    def forget(self, device_key):
+        try:
+            os.unlink(self.__get_fname(device_key))
+        except (IOError, OSError):
+            pass
+
+    def __get_fname(self, device_key):
+        return os.path.join(self.directory,
+                            re.sub(r"[^\w.-]", "_", device_key) + ".bin")
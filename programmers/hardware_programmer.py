@@ -1,14 +1,66 @@
 from . import programmer_exceptions as ex
+from .crc32 import CRC32
+from .memory_dump import create_dump_writer, DumpCheckpoint
 
 from network import protocol as pl
-from network import PacketType
+from network import PacketType as pt
+from network import network_exceptions as net_ex
+from network import compression
 
 from abc import abstractmethod, ABCMeta
+from collections import deque, namedtuple
 from intelhex import IntelHex
 
+import os
+
 
 PACKET_WAIT_TIMEOUT = 1.
 
+# Device reads memory to answer read and CRC requests
+MEMORY_READ_TIMEOUT = 20
+
+# Number of memory chunks dumped between checkpoints
+DUMP_CHECKPOINT_INTERVAL = 16
+
+# Number of READ_MEMORY and CMD requests sent before the oldest one
+#   is answered. 1 means the classic send/wait behaviour.
+DEFAULT_READ_AHEAD = 1
+
+# How many times a memory chunk is requested again after timeout
+MAX_READ_RETRIES = 3
+
+# Programmers without capabilities support don't answer init packet
+CAPABILITIES_TIMEOUT = 0.3
+
+# Programmers without CRC support may not answer CRC request
+CRC_PROBE_TIMEOUT = 0.3
+
+# Number of packets which may be sent before the oldest one is answered.
+# 1 means the classic send/wait behaviour.
+DEFAULT_WINDOW_SIZE = 1
+
+
+# Describes piece of memory carried by one in-flight packet
+ProgMemChunk = namedtuple("ProgMemChunk", ["index", "address",
+                                           "memory_type_byte", "length"])
+
+
+def load_image(fname):
+    """
+    Reads either .hex or .bin file into IntelHex
+    """
+    extention = fname.split('.')[-1]
+    intel_hex = IntelHex()
+
+    if extention == 'hex':
+        intel_hex.fromfile(fname, format='hex')
+    elif extention == 'bin':
+        intel_hex.fromfile(fname, format='bin')
+    else:
+        raise ValueError("Wrong file extention: " + extention)
+
+    return intel_hex
+
 
 class HardwareProgrammer(object):
     """
@@ -19,15 +71,46 @@ class HardwareProgrammer(object):
     MEMORY_EEPROM_BYTE = 0x01
     MEMORY_FLASH_BYTE = 0x00
 
-    def __init__(self, packet_manager):
+    def __init__(self, packet_manager, window_size=DEFAULT_WINDOW_SIZE,
+                 read_ahead=DEFAULT_READ_AHEAD, use_compression=False,
+                 capabilities_store=None):
+        """
+        use_compression     --- compress memory packets if programmer
+                                    supports it
+        capabilities_store  --- CapabilitiesStore which remembers what
+                                    programmer answered at init
+        """
+        if window_size < 1:
+            raise ValueError("Window size must be at least 1")
+
+        if read_ahead < 1:
+            raise ValueError("Read ahead must be at least 1")
+
         self.packet_manager = packet_manager
+        self.window_size = window_size
+        self.read_ahead = read_ahead
+
+        self.use_compression = use_compression
+        self.capabilities_store = capabilities_store
+        # Turned on by programmer init if programmer supports it
+        self.compression = False
+        self.cmd_batch = False
+
+        # (expected packet type, chunk) for every unanswered packet
+        self._in_flight = deque()
+        self._chunk_counter = 0
+
+        self.crc32 = CRC32()
+        # Unknown until probe_crc_support() is called
+        self.crc_supported = None
 
     @abstractmethod
     def _write_file_to_eeprom(self, eeprom_file, start_address, validate):
         pass
 
     @abstractmethod
-    def _write_file_to_flash(self, flash_file, start_address, validate):
+    def _write_file_to_flash(self, flash_file, start_address, validate,
+                             differential=False):
         pass
 
     @abstractmethod
@@ -38,46 +121,254 @@ class HardwareProgrammer(object):
     def _read_eeprom_memory(self):
         pass
 
-    def burn_file(self, fname, memory, start_address=None, validate=False):
-        extention = fname.split('.')[-1]
-        intel_hex = IntelHex()
+    def burn_file(self, fname, memory, start_address=None, validate=False,
+                  differential=False):
+        self.burn_image(load_image(fname), memory, start_address, validate,
+                        differential)
 
-        if extention == 'hex':
-            intel_hex.fromfile(fname, format='hex')
-        elif extention == 'bin':
-            intel_hex.fromfile(fname, format='bin')
-        else:
-            raise ValueError("Wrong file extention: " + extention)
+    def burn_image(self, intel_hex, memory, start_address=None,
+                   validate=False, differential=False):
+        """
+        Writes already loaded image. Image is not modified, so the same
+            one could be burnt by several programmers at once.
 
+        differential    --- write only flash pages which differ from
+                                those written last time. Chip is erased
+                                by programmer itself if it is needed.
+        """
         if memory == 'flash':
-            self._write_file_to_flash(intel_hex, start_address, validate)
+            self._run_transfer(self._write_file_to_flash, intel_hex,
+                               start_address, validate, differential)
         elif memory == 'eeprom':
-            self._write_file_to_eeprom(intel_hex, start_address, validate)
+            self._run_transfer(self._write_file_to_eeprom, intel_hex,
+                               start_address, validate)
         else:
             raise ValueError("Wrong memory specified: " + memory)
 
+    def _run_transfer(self, write, *args):
+        """
+        Runs memory write and waits for answers on all its packets
+        """
+        self._chunk_counter = 0
+
+        try:
+            write(*args)
+            self.flush_window()
+        finally:
+            self._in_flight.clear()
+
     def read_memory(self, memory_t, fname=None):
+        """
+        Reads the whole memory
+
+        fname   --- .bin or .hex file. If it is given, memory is written
+                        there chunk by chunk and None is returned.
+                        Interrupted dump is continued on the next call.
+
+        returns bytearray with memory if fname is None
+        """
+        if fname is not None:
+            return self._dump_memory(memory_t, fname)
+
         if memory_t == 'flash':
-            memory = self._read_flash_memory()
+            return self._read_flash_memory()
         elif memory_t == 'eeprom':
-            memory = self._read_eeprom_memory()
+            return self._read_eeprom_memory()
 
-        if fname is not None:
-            self._save_memory(fname, memory, memory_t)
+        raise ValueError("Wrong memory specified: " + memory_t)
 
-        return memory
+    def _dump_memory(self, memory_t, fname):
+        if memory_t == 'flash':
+            memory_type_byte = self.MEMORY_FLASH_BYTE
+            size = self.flash_size
+        elif memory_t == 'eeprom':
+            memory_type_byte = self.MEMORY_EEPROM_BYTE
+            size = self.eeprom_size
+        else:
+            raise ValueError("Wrong memory specified: " + memory_t)
+
+        checkpoint = DumpCheckpoint(fname)
+        progress = None
+
+        if os.path.exists(fname):
+            progress = checkpoint.load(memory_t, size)
+
+        if progress is None:
+            done, writer_state = 0, None
+        else:
+            done, writer_state = progress
+            print("Continuing dump from 0x%06x" % done)
 
-    def send(self, raw_data, packet_type):
-        self.packet_manager.send_raw(raw_data, packet_type)
+        writer = create_dump_writer(fname, memory_t, size, writer_state)
+        complete = False
+
+        try:
+            chunks = self._read_memory_chunks(memory_type_byte, done, size)
+
+            for i, (offset, data) in enumerate(chunks):
+                writer.write(offset, data)
+                done = offset + len(data)
+
+                if (i + 1) % DUMP_CHECKPOINT_INTERVAL == 0:
+                    checkpoint.save(memory_t, size, done, writer.state())
+
+            complete = True
+
+        finally:
+            if complete:
+                writer.finish()
+                checkpoint.remove()
+            else:
+                checkpoint.save(memory_t, size, done, writer.state())
+                writer.close()
+
+    def send(self, raw_data, packet_type, comp=False, prefix=None):
+        """
+        prefix  --- data which goes in front of raw_data or None.
+                        It is sent without joining with raw_data.
+        """
+        self.packet_manager.send_raw(raw_data, packet_type, comp, prefix)
+
+    def send_programmer_init(self, programmer_byte, device_key=None):
+        """
+        Starts programmer and negotiates capabilities. Instruction
+            batching is always offered, compression only if it is
+            requested. Programmers which don't know capabilities make
+            init wait for CAPABILITIES_TIMEOUT, unless capabilities
+            store knows it already.
+
+        device_key  --- identifies programmer in capabilities store
+        """
+        self.compression = False
+        self.cmd_batch = False
+
+        store = self.capabilities_store
+        if device_key is None:
+            store = None
+
+        if (store is not None) and (store.load(device_key) == 0):
+            # Programmer doesn't answer init with capabilities
+            self.send([programmer_byte], pt.PROGRAMMER_INIT_PACKET)
+            return
+
+        capabilities = pl.PL_CAP_CMD_BATCH
+        if self.use_compression:
+            capabilities |= pl.PL_CAP_COMPRESSION
+
+        self.send([programmer_byte, capabilities], pt.PROGRAMMER_INIT_PACKET)
+
+        try:
+            packet = self.read_packet(timeout=CAPABILITIES_TIMEOUT)
+        except (net_ex.NetworkTimeoutError, net_ex.ErrorPacketError):
+            print("Programmer doesn't support capabilities")
+
+            if store is not None:
+                store.save(device_key, 0)
+            return
+
+        self._check_packet(packet, pt.ACK_PACKET)
+
+        answered = 0
+        data = packet.data or []
+        if len(data) > pl.PL_CAPABILITIES_ACK_OFFSET:
+            answered = data[pl.PL_CAPABILITIES_ACK_OFFSET]
+
+        supported = answered & capabilities
+        self.compression = bool(supported & pl.PL_CAP_COMPRESSION)
+        self.cmd_batch = bool(supported & pl.PL_CAP_CMD_BATCH)
+
+        if store is not None:
+            store.save(device_key, answered)
+
+        if self.use_compression:
+            print("Compression is " + ("on" if self.compression else "off"))
 
     def read_packet(self, timeout=PACKET_WAIT_TIMEOUT):
         return self.packet_manager.read_packet(timeout=timeout)
 
     def send_recv(self, raw_data, packet_type,
                   timeout=PACKET_WAIT_TIMEOUT):
+        self.flush_window()
         self.send(raw_data, packet_type)
         return self.read_packet(timeout=timeout)
 
+    def send_windowed(self, raw_data, packet_type, exp_type, chunk=None,
+                      prefix=None):
+        """
+        Sends packet without waiting for its answer while the window
+            is not full. Otherwise waits for the oldest answer first.
+
+        raw_data    --- packet payload
+        packet_type --- type of packet to send
+        exp_type    --- type of packet which is expected as answer
+        chunk       --- ProgMemChunk carried by packet or None
+        prefix      --- data which goes in front of raw_data or None
+
+        Answers come in the same order as packets were sent, so they are
+            matched with in-flight packets one by one.
+
+        Program memory packets are compressed if it makes them shorter.
+
+        Raises ChunkTransferError if answer for a chunk is wrong
+        """
+        comp = False
+
+        if self.compression and (packet_type == pt.PROGRAM_MEMORY_PACKET):
+            payload = raw_data
+            if prefix is not None:
+                payload = bytearray(prefix)
+                payload.extend(raw_data)
+
+            encoded = compression.encode(payload)
+
+            if len(encoded) < len(payload):
+                raw_data, prefix, comp = encoded, None, True
+
+        self.send(raw_data, packet_type, comp, prefix)
+        self._in_flight.append((exp_type, chunk))
+
+        while len(self._in_flight) >= self.window_size:
+            self._collect_answer()
+
+    def flush_window(self):
+        """
+        Waits for answers on all in-flight packets
+        """
+        while self._in_flight:
+            self._collect_answer()
+
+    def _collect_answer(self):
+        exp_type, chunk = self._in_flight.popleft()
+
+        try:
+            packet = self.read_packet()
+            self._check_packet(packet, exp_type)
+
+            if exp_type == pt.ACK_PACKET:
+                self._check_ack(packet)
+
+        except IOError as e:
+            # Nothing sent after the failed packet can be trusted.
+            #   Their answers must not be taken by next requests, late
+            #   answer of the failed packet is among them.
+            unanswered = len(self._in_flight)
+            if isinstance(e, net_ex.NetworkTimeoutError):
+                unanswered += 1
+
+            self._in_flight.clear()
+
+            try:
+                self.__drain_answers(unanswered)
+            except IOError:
+                pass
+
+            if chunk is None:
+                raise
+
+            raise ex.ChunkTransferError(chunk, str(e))
+
+        return packet
+
     # ######################################
     # Sends command which is byte array
     # ######################################
@@ -85,11 +376,94 @@ class HardwareProgrammer(object):
                      timeout=PACKET_WAIT_TIMEOUT,
                      wait_answer=True):
 
+        self.flush_window()
         self.send(command, pt.CMD_PACKET)
 
         if wait_answer:
             return self.read_packet(timeout=timeout)
 
+    def send_command_batch(self, commands, timeout=PACKET_WAIT_TIMEOUT,
+                           depth=None):
+        """
+        Executes 4-byte instructions in the given order
+
+        Programmer which supports batches gets them in as few CMD
+            packets as possible. Otherwise every instruction goes in
+            its own packet, but up to depth packets are sent before
+            the oldest answer is read.
+
+        commands    --- sequence of 4-byte instructions
+        depth       --- number of CMD packets in flight. read_ahead
+                            if it is None.
+
+        returns list with result byte of every instruction
+        """
+        self.flush_window()
+
+        if self.cmd_batch:
+            return self.__send_batched_commands(commands, timeout)
+
+        if depth is None:
+            depth = self.read_ahead
+
+        return self.__send_pipelined_commands(commands, timeout, depth)
+
+    def __send_batched_commands(self, commands, timeout):
+        per_packet = pl.PL_MAX_DATA_LENGTH // pl.PL_CMD_SIZE
+        results = []
+
+        for i in range(0, len(commands), per_packet):
+            group = commands[i:i + per_packet]
+
+            payload = bytearray()
+            for command in group:
+                payload.extend(command)
+
+            self.send(payload, pt.CMD_PACKET)
+            packet = self.read_packet(timeout=timeout)
+            self._check_packet(packet, pt.CMD_PACKET)
+
+            if packet.data_length != len(payload):
+                raise ex.WrongPacketError("Expected answers for %d "
+                                          "instructions. Got %d bytes" %
+                                          (len(group), packet.data_length))
+
+            results.extend(packet.cmd_answer(k) for k in range(len(group)))
+
+        return results
+
+    def __send_pipelined_commands(self, commands, timeout, depth):
+        results = []
+        sent = 0
+
+        while len(results) < len(commands):
+            while (sent < len(commands)) and\
+                    (sent - len(results) < depth):
+                self.send(commands[sent], pt.CMD_PACKET)
+                sent += 1
+
+            try:
+                packet = self.read_packet(timeout=timeout)
+                self._check_packet(packet, pt.CMD_PACKET)
+
+            except IOError as e:
+                # Answers of the rest must not be taken by next requests.
+                #   Answer which is late is among them.
+                unanswered = sent - len(results)
+                if not isinstance(e, net_ex.NetworkTimeoutError):
+                    unanswered -= 1
+
+                try:
+                    self.__drain_answers(unanswered)
+                except IOError:
+                    pass
+
+                raise
+
+            results.append(packet.cmd_answer())
+
+        return results
+
     # ####################################
     # Creates command packet
     # from 4 bytes
@@ -117,23 +491,50 @@ class HardwareProgrammer(object):
         # 4 bytes for address and 1 byte for memory type
         header_size = 5
 
-        raw_packet = bytearray(len(raw_data) + header_size)
-        raw_packet[0:4] = self.int_to_bytes(address)
-        raw_packet[4] = memory_type_byte
-        raw_packet[5:] = raw_data[:]
+        # Data is sent after the header as it is
+        header = bytearray(header_size)
+        header[0:4] = self.int_to_bytes(address)
+        header[4] = memory_type_byte
+
+        self._send_prog_mem_payload(raw_data, address, memory_type_byte,
+                                    len(raw_data), header)
+
+    def _send_prog_mem_payload(self, payload, address, memory_type_byte,
+                               length, prefix=None):
+        """
+        Sends program memory packet which data is already prepared
+
+        payload --- packet data with address and memory type header
+                        unless the header is given as prefix
+        length  --- number of memory bytes in payload
+        """
+        chunk = self._next_chunk(address, memory_type_byte, length)
+        self.send_windowed(payload, pt.PROGRAM_MEMORY_PACKET,
+                           pt.ACK_PACKET, chunk, prefix)
+
+    def _next_chunk(self, address, memory_type_byte, length):
+        chunk = ProgMemChunk(self._chunk_counter, address,
+                             memory_type_byte, length)
+        self._chunk_counter += 1
 
-        ack = self.send_recv(raw_packet, pt.PROG_MEM_PACKET)
-        self._check_packet(ack, pt.ACK_PACKET)
+        return chunk
+
+    def _get_memory_data(self, memory_packet):
+        """
+        returns bytearray with memory from MEMORY packet
+        """
+        self._check_packet(memory_packet, pt.MEMORY_PACKET)
+        data = memory_packet.data or []
 
-    def _read_flash_memory_chunk(self, address, bytes_to_read):
-        return self._read_memory_chunk(address, bytes_to_read,
-                                       HardwareProgrammer.MEMORY_FLASH_BYTE)
+        if not self.compression:
+            return bytearray(data)
 
-    def _read_eeprom_memory_chunk(self, address, bytes_to_read):
-        return self._read_memory_chunk(address, bytes_to_read,
-                                       HardwareProgrammer.MEMORY_EEPROM_BYTE)
+        try:
+            return compression.decode(data)
+        except ValueError as e:
+            raise ex.WrongPacketError("Broken compressed memory: " + str(e))
 
-    def _read_memory_chunk(self, address, bytes_to_read, memory_type):
+    def _make_read_request(self, address, bytes_to_read, memory_type):
         # 1 byte for memory type
         # 4 bytes for start address
         # 4 bytes for number of bytes to read
@@ -144,166 +545,346 @@ class HardwareProgrammer(object):
         read_data[1:5] = self.int_to_bytes(address)[0:4]
         read_data[5:9] = self.int_to_bytes(bytes_to_read)[0:4]
 
-        memory_packet = self.send_recv(read_data, pt.READ_MEM_PACKET,
-                                       timeout=20)
-        self._check_packet(memory_packet, pt.MEMORY_PACKET)
-
-        return bytearray(memory_packet['data'])
+        return read_data
 
     def _read_memory(self, memory_type_byte):
-        packet_header_size = 3
-        max_bytes_to_read = pl.MAX_PACKET_LENGTH - packet_header_size
-
-        if max_bytes_to_read % 2 != 0:
-            max_bytes_to_read -= 1
-
         if memory_type_byte == HardwareProgrammer.MEMORY_FLASH_BYTE:
-            read_chunk = self._read_flash_memory_chunk
             memory_size = self.flash_size
 
         elif memory_type_byte == HardwareProgrammer.MEMORY_EEPROM_BYTE:
-            read_chunk = self._read_eeprom_memory_chunk
             memory_size = self.eeprom_size
 
+        return self._read_memory_range(memory_type_byte, 0, memory_size)
+
+    def _read_memory_range(self, memory_type_byte, address, length):
+        """
+        Reads length bytes starting at address. Address is in memory
+            units: words for flash and bytes for eeprom.
+        """
+        start = self._address_to_bytes(memory_type_byte, address)
         memory = bytearray()
 
-        data_cnt = 0
-        address = 0
+        for _, data in self._read_memory_chunks(memory_type_byte, start,
+                                                start + length):
+            memory.extend(data)
 
-        while data_cnt < memory_size:
-            bytes_to_read = min(max_bytes_to_read, memory_size - data_cnt)
-            chunk = read_chunk(address, bytes_to_read)
-            memory.extend(chunk)
+        return memory
 
-            data_cnt += bytes_to_read
+    def _read_memory_chunks(self, memory_type_byte, start, stop):
+        """
+        Reads memory from byte offset start up to stop packet by packet.
+            Up to read_ahead requests are sent before the oldest one
+            is answered.
 
-            if memory_type_byte == HardwareProgrammer.MEMORY_FLASH_BYTE:
-                address = data_cnt // 2
-            else:
-                address = data_cnt
+        Answers come in the same order as requests. If answer doesn't
+            come in time, the rest of answers is drained and reading
+            starts again from the late chunk.
 
-        return memory
+        returns generator of (byte offset, bytearray)
+        """
+        packet_header_size = 3
+        max_bytes_to_read = pl.PL_MAX_DATA_LENGTH - packet_header_size
+
+        if self.compression:
+            # Memory must fit into packet even if it can't be compressed
+            max_bytes_to_read = \
+                compression.max_decoded_length(max_bytes_to_read)
+
+        if max_bytes_to_read % 2 != 0:
+            max_bytes_to_read -= 1
+
+        self.flush_window()
+
+        segment_size = self._memory_segment_size(memory_type_byte)
+
+        # (byte offset, length) of every unanswered request
+        pending = deque()
+        retries = {}
+        offset = start
+
+        try:
+            while pending or (offset < stop):
+                while (offset < stop) and (len(pending) < self.read_ahead):
+                    bytes_to_read = min(max_bytes_to_read, stop - offset)
 
-    def _save_memory(self, fname, memory, memory_type):
+                    if segment_size is not None:
+                        segment = offset // segment_size
+
+                        # Segment is switched by command, which answer
+                        #   must not get between memory answers
+                        if pending and\
+                                (pending[-1][0] // segment_size != segment):
+                            break
+
+                        self._select_memory_segment(memory_type_byte,
+                                                    offset)
+
+                        segment_end = (segment + 1) * segment_size
+                        bytes_to_read = min(bytes_to_read,
+                                            segment_end - offset)
+
+                    address = self._bytes_to_address(memory_type_byte,
+                                                     offset)
+
+                    self.send(self._make_read_request(address, bytes_to_read,
+                                                      memory_type_byte),
+                              pt.READ_MEMORY_PACKET, self.compression)
+                    pending.append((offset, bytes_to_read))
+                    offset += bytes_to_read
+
+                chunk_offset, bytes_to_read = pending[0]
+
+                try:
+                    packet = self.read_packet(timeout=MEMORY_READ_TIMEOUT)
+
+                except net_ex.NetworkTimeoutError:
+                    retries[chunk_offset] = retries.get(chunk_offset, 0) + 1
+
+                    if retries[chunk_offset] > MAX_READ_RETRIES:
+                        raise
+
+                    print("No memory at 0x%06x. Requesting again" %
+                          chunk_offset)
+
+                    self.__drain_answers(len(pending))
+                    pending.clear()
+                    offset = chunk_offset
+                    continue
+
+                pending.popleft()
+
+                data = self._get_memory_data(packet)
+                if len(data) != bytes_to_read:
+                    raise ex.WrongPacketError("Expected %d bytes of memory. "
+                                              "Got %d" %
+                                              (bytes_to_read, len(data)))
+
+                yield chunk_offset, data
+
+        finally:
+            # Reading was interrupted. Answers must not be taken by
+            #   the next request.
+            if pending:
+                try:
+                    self.__drain_answers(len(pending))
+                except IOError:
+                    pass
+
+    def _memory_segment_size(self, memory_type_byte):
+        """
+        returns size in bytes of memory segments which are selected
+            by separate command or None if memory is not segmented.
+            Memory requests don't cross segment bounds.
+        """
+        return None
+
+    def _select_memory_segment(self, memory_type_byte, byte_offset):
         """
-        Saves memory either into binary file or into hex using
-            IntelHex library
+        Makes segment with byte_offset current if it is not already.
+            Called when no memory request is in flight.
+        """
+        pass
+
+    def __drain_answers(self, count, timeout=PACKET_WAIT_TIMEOUT):
+        """
+        Drops answers on requests which are already sent
+        """
+        try:
+            for _ in range(count):
+                self.read_packet(timeout=timeout)
+
+        except net_ex.NetworkTimeoutError:
+            pass
 
-        fname               --- filename to save into.
-                                Must have extension .bin or .hex
+    def _bytes_to_address(self, memory_type_byte, byte_offset):
+        if memory_type_byte == HardwareProgrammer.MEMORY_FLASH_BYTE:
+            return byte_offset // 2
+
+        return byte_offset
 
-        memory              --- bytearray which contains memory
+    def _address_to_bytes(self, memory_type_byte, address):
+        if memory_type_byte == HardwareProgrammer.MEMORY_FLASH_BYTE:
+            return address * 2
 
-        memory_type_byte    --- specifies memory type: flash or eeprom.
-                                    If memory is flash and file is hex then
-                                    memory will be cleared from 0xFF 0xFF
-                                    before saving.
+        return address
 
-        Returns None
+    # ####################################
+    # Verification
+    # ####################################
+    def verify_regions(self, memory_type_byte, regions):
         """
-        extension = fname.split('.')[-1]
+        Compares memory with data which was written there
+
+        regions --- list of (address, data). Address is in memory units:
+                        words for flash and bytes for eeprom
 
-        if extension == 'bin':
-            bin_mem = self._make_bin_map(memory, memory_type)
-            f = open(fname, 'wb')
-            self._save_bin(f, bin_mem)
+        Device computes CRC of every region, so only regions with wrong
+            CRC are read back. Everything is read back if device can't
+            compute CRC.
 
-        elif extension == 'hex':
-            memory_map = self._make_hex_map(memory, memory_type)
-            f = open(fname, 'w')
-            self._save_hex(f, memory_map)
+        Raises VerificationError
+        """
+        regions = [(address, data) for address, data in regions if data]
+        suspicious = regions
 
+        if self.probe_crc_support():
+            suspicious = self._find_crc_mismatches(memory_type_byte, regions)
         else:
-            raise ValueError("Wrong file extention: " + extension)
+            print("Device can't compute CRC. Reading memory back")
 
-        f.close()
+        print("Reading back %d of %d regions" %
+              (len(suspicious), len(regions)))
 
-    def _save_bin(self, fobj, memory):
-        intel_hex = IntelHex()
-        intel_hex.frombytes(memory)
-        intel_hex.tofile(fobj, 'bin')
+        for address, data in suspicious:
+            memory = self._read_memory_range(memory_type_byte, address,
+                                             len(data))
+            self.__compare_region(memory_type_byte, address, data, memory)
 
-    def _save_hex(self, fobj, memory):
-        intel_hex = IntelHex()
-        intel_hex.fromdict(memory)
-        intel_hex.tofile(fobj, 'hex')
+    def probe_crc_support(self):
+        """
+        Finds out if device computes CRC with request on a single word.
+            Device which can't do it answers with error or doesn't
+            answer at all, so it is waited for CRC_PROBE_TIMEOUT only.
+            Result is kept in crc_supported.
 
-    def _make_hex_map(self, memory, memory_type):
+        returns True if device computes CRC
         """
-        If EEPROM memory is given, converts array to dictionary.
-        For FLASH memory it clears it from 0xFF 0xFF and converts data into
-            dictionary with address as key and value as address byte value
+        if self.crc_supported is not None:
+            return self.crc_supported
 
-        memory              --- bytearray which contains memory
-        memory_type_byte    --- specifies memory. Either flash or eeprom
+        request = bytearray([self.MEMORY_FLASH_BYTE])
+        request.extend(self.int_to_bytes(0))
+        request.extend(self.int_to_bytes(2))
 
-        returns dict[address] = byte
-        """
+        try:
+            packet = self.send_recv(request, pt.READ_MEMORY_CRC_PACKET,
+                                    timeout=CRC_PROBE_TIMEOUT)
+            self._check_packet(packet, pt.MEMORY_CRC_PACKET)
+            self.crc_supported = True
 
-        if memory_type == 'eeprom':
-            return self._list2dict(memory)
+        except net_ex.ErrorPacketError:
+            self.crc_supported = False
 
-        mem_map = {}
+        except net_ex.NetworkTimeoutError:
+            self.crc_supported = False
 
-        for addr in range(0, len(memory), 2):
-            low_byte = memory[addr]
-            high_byte = memory[addr+1]
+            # Late answer must not be taken by the next request
+            self.__drain_answers(1, CRC_PROBE_TIMEOUT)
 
-            if (low_byte != 0xFF) and (high_byte != 0xFF):
-                mem_map[addr] = low_byte
-                mem_map[addr+1] = high_byte
+        return self.crc_supported
 
-        return mem_map
+    def memory_matches(self, memory_type_byte, regions):
+        """
+        Checks memory the same way as verify_regions does
 
-    def _list2dict(self, l):
-        d = {}
-        for i in range(len(l)):
-            d[i] = l[i]
+        returns True if every region matches memory
+        """
+        try:
+            self.verify_regions(memory_type_byte, regions)
+        except ex.VerificationError:
+            return False
 
-        return d
+        return True
 
-    def _make_bin_map(self, memory, memory_type):
+    def _find_crc_mismatches(self, memory_type_byte, regions):
+        """
+        returns regions which CRC differs from device one
         """
-        Does nothing for EEPROM memory and deletes unprogrammed memory from the
-            end of FLASH memory
+        ranges_per_packet = min(
+            pl.PL_MAX_DATA_LENGTH // pl.PL_CRC_RANGE_SIZE,
+            pl.PL_MAX_DATA_LENGTH // pl.PL_CRC_VALUE_SIZE)
+
+        mismatches = []
 
-        memory              --- bytearray which contains memory
-        memory_type_byte    --- specifies memory type. Either flash or eeprom
+        for group in self.__group_by_segment(memory_type_byte, regions,
+                                             ranges_per_packet):
+            self._select_memory_segment(
+                memory_type_byte,
+                self._address_to_bytes(memory_type_byte, group[0][0]))
 
-        return bytearray with deleted 0xFF 0xFF from the end if memory is FLASH
-            and return copy of data if memory is EEPROM
+            request = bytearray()
+
+            for address, data in group:
+                request.append(memory_type_byte)
+                request.extend(self.int_to_bytes(address))
+                request.extend(self.int_to_bytes(len(data)))
+
+            packet = self.send_recv(request, pt.READ_MEMORY_CRC_PACKET,
+                                    timeout=MEMORY_READ_TIMEOUT)
+            self._check_packet(packet, pt.MEMORY_CRC_PACKET)
+
+            crc_values = packet.data or []
+            if len(crc_values) != len(group) * pl.PL_CRC_VALUE_SIZE:
+                raise ex.WrongPacketError("Expected %d CRC values. Got %d "
+                                          "bytes" %
+                                          (len(group), len(crc_values)))
+
+            for k, (address, data) in enumerate(group):
+                offset = k * pl.PL_CRC_VALUE_SIZE
+                device_crc = int.from_bytes(
+                    bytes(crc_values[offset:offset + pl.PL_CRC_VALUE_SIZE]),
+                    'big')
+
+                if device_crc != self.crc32.crc32_stm(data):
+                    mismatches.append((address, data))
+
+        return mismatches
+
+    def __group_by_segment(self, memory_type_byte, regions, group_size):
+        """
+        Splits regions into groups of group_size at most. Regions of
+            a group start in the same memory segment.
+
+        returns generator of lists of (address, data)
         """
-        cleared_memory = bytearray(memory)
+        segment_size = self._memory_segment_size(memory_type_byte)
+        group = []
+        group_segment = None
 
-        if memory_type == 'eeprom':
-            return cleared_memory
+        for address, data in regions:
+            segment = None
+            if segment_size is not None:
+                segment = self._address_to_bytes(memory_type_byte,
+                                                 address) // segment_size
 
-        # Flash memory
-        free_mem = None
+            if group and ((len(group) == group_size) or
+                          (segment != group_segment)):
+                yield group
+                group = []
 
-        for i in range(0, len(memory), 2):
-            low_b = memory[i]
-            high_b = memory[i+1]
+            group.append((address, data))
+            group_segment = segment
 
-            if (low_b == high_b == 0xFF) and (free_mem is None):
-                free_mem = i
+        if group:
+            yield group
 
-            elif (low_b != 0xFF) or (high_b != 0xFF) and (free_mem is not None):
-                free_mem = None
+    def __compare_region(self, memory_type_byte, address, data, memory):
+        if memory == data:
+            return
 
-        if free_mem is not None:
-            del cleared_memory[free_mem:]
+        diff = [i for i in range(len(data)) if memory[i] != data[i]]
+        first = diff[0]
 
-        return cleared_memory
+        # Report address in bytes
+        byte_address = address + first
+        if memory_type_byte == HardwareProgrammer.MEMORY_FLASH_BYTE:
+            byte_address = address * 2 + first
+
+        raise ex.VerificationError(byte_address, data[first], memory[first],
+                                   len(diff))
 
     def _check_packet(self, packet, exp_type):
-        if packet['type'] != exp_type:
+        if packet.type != exp_type:
             packet_name = self.packet_manager.get_packet_name(packet)
             exp_name = self.packet_manager.get_packet_name_by_type(exp_type)
 
             raise ex.WrongPacketError("Expected packet %s. Got %s packet" %
                                       (exp_name, packet_name))
 
+    def _check_ack(self, packet):
+        if packet.ack_byte() == pl.PL_ACK_FAILURE:
+            raise ex.HardwareError("Device answered with failure ACK")
+
     # #############################
     #   Converts 4-bytes integer
     #   to bytes list
@@ -0,0 +1,195 @@
+import hashlib
+import mmap
+import os
+import struct
+
+from collections import namedtuple
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".bigblack",
+                                 "image_cache")
+
+# Bump it when payloads or file layout change
+CACHE_MAGIC = b"BBIMG001"
+
+# Operations of flash write stream
+OP_PROG_MEM = 0
+OP_WRITE_PAGE = 1
+
+# kind, page, address, payload offset, payload length
+OP_ENTRY = struct.Struct(">BIIII")
+
+# image data length, number of operations
+HEADER = struct.Struct(">II")
+
+# One packet of flash write stream.
+#   payload is ready to be sent as is: PROGRAM_MEMORY packet data with
+#   address header for OP_PROG_MEM and ISP command for OP_WRITE_PAGE.
+StreamOp = namedtuple("StreamOp", ["kind", "page", "address", "payload"])
+
+
+def file_digest(fname):
+    sha = hashlib.sha256()
+
+    with open(fname, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+class CachedImage(object):
+    """
+    Memory mapped cache file.
+
+    File layout:
+        magic | header | operations table | image data | payloads
+
+    Image data is the flat flash image needed for flash records and
+        differential writes.
+    """
+
+    def __init__(self, fname):
+        self.__file = open(fname, "rb")
+
+        try:
+            self.__map = mmap.mmap(self.__file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            self.__file.close()
+            raise
+
+        self.view = memoryview(self.__map)
+        self.ops = []
+        self.data = None
+        self.dirty_pages = []
+
+        try:
+            self.__parse()
+        except (ValueError, struct.error):
+            self.close()
+            raise
+
+    def __parse(self):
+        offset = len(CACHE_MAGIC)
+        if self.view[:offset] != CACHE_MAGIC:
+            raise ValueError("Not an image cache file")
+
+        data_length, ops_num = HEADER.unpack_from(self.view, offset)
+        offset += HEADER.size
+
+        pages = set()
+
+        for _ in range(ops_num):
+            kind, page, address, payload_offset, payload_length = \
+                OP_ENTRY.unpack_from(self.view, offset)
+            offset += OP_ENTRY.size
+
+            if payload_offset + payload_length > len(self.view):
+                raise ValueError("Image cache file is truncated")
+
+            payload = self.view[payload_offset:
+                                payload_offset + payload_length]
+            self.ops.append(StreamOp(kind, page, address, payload))
+            pages.add(page)
+
+        self.data = self.view[offset:offset + data_length]
+        self.dirty_pages = sorted(pages)
+
+    def close(self):
+        # Slices must be released before mmap could be closed
+        for op in self.ops:
+            op.payload.release()
+
+        self.ops = []
+
+        if self.data is not None:
+            self.data.release()
+            self.data = None
+
+        self.view.release()
+        self.__map.close()
+        self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ImageCache(object):
+    """
+    Keeps prepared flash write streams, so the same firmware is parsed
+        and split into packets only once.
+
+    Entries are keyed by firmware contents and target part.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR):
+        self.directory = directory
+
+    def make_key(self, fname, part_id, *params):
+        """
+        fname   --- firmware file
+        part_id --- target part
+        params  --- anything else payloads depend on
+        """
+        key = [file_digest(fname), part_id] + [str(p) for p in params]
+        return "_".join(key)
+
+    def load(self, key):
+        """
+        returns CachedImage or None if there is no valid entry
+        """
+        try:
+            return CachedImage(self.__get_fname(key))
+
+        except (IOError, OSError, ValueError, struct.error):
+            return None
+
+    def store(self, key, image_data, ops):
+        """
+        Writes entry and maps it back
+
+        image_data  --- flat flash image
+        ops         --- StreamOp sequence
+
+        returns CachedImage or None if cache can't be written
+        """
+        ops = list(ops)
+
+        table_offset = len(CACHE_MAGIC) + HEADER.size
+        payload_offset = table_offset + OP_ENTRY.size * len(ops) + \
+            len(image_data)
+
+        fname = self.__get_fname(key)
+        tmp_fname = fname + ".tmp"
+
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+
+            with open(tmp_fname, "wb") as f:
+                f.write(CACHE_MAGIC)
+                f.write(HEADER.pack(len(image_data), len(ops)))
+
+                for op in ops:
+                    f.write(OP_ENTRY.pack(op.kind, op.page, op.address,
+                                          payload_offset, len(op.payload)))
+                    payload_offset += len(op.payload)
+
+                f.write(image_data)
+
+                for op in ops:
+                    f.write(op.payload)
+
+            os.rename(tmp_fname, fname)
+
+        except (IOError, OSError):
+            return None
+
+        return self.load(key)
+
+    def __get_fname(self, key):
+        return os.path.join(self.directory, key + ".img")
@@ -0,0 +1,267 @@
+import json
+import os
+import re
+
+
+ERASED_WORD = b'\xff\xff'
+WORD_SIZE = len(ERASED_WORD)
+
+# Runs of erased bytes. Only whole words inside of them are erased.
+_ERASED_RUN = re.compile(b'\xff{%d,}' % WORD_SIZE)
+
+# Bytes per data record of hex file
+HEX_RECORD_SIZE = 16
+
+HEX_DATA_RECORD = 0x00
+HEX_EOF_RECORD = 0x01
+HEX_EXT_LINEAR_ADDR_RECORD = 0x04
+
+
+def hex_record(record_type, address, data=b''):
+    """
+    returns Intel HEX record line
+    """
+    record = bytearray([len(data), (address >> 8) & 0xFF, address & 0xFF,
+                        record_type])
+    record.extend(data)
+    record.append((-sum(record)) & 0xFF)
+
+    return ":" + record.hex().upper() + "\n"
+
+
+def erased_word_runs(data):
+    """
+    Finds erased words in data which starts at word boundary
+
+    returns generator of (start, stop) byte offsets
+    """
+    for match in _ERASED_RUN.finditer(data):
+        start = match.start() + (-match.start()) % WORD_SIZE
+        stop = match.end() - match.end() % WORD_SIZE
+
+        if stop > start:
+            yield start, stop
+
+
+def programmed_word_runs(data):
+    """
+    Same as erased_word_runs for words which are not erased
+    """
+    runs = []
+    start = 0
+
+    for erased_start, erased_stop in erased_word_runs(data):
+        if erased_start > start:
+            runs.append((start, erased_start))
+
+        start = erased_stop
+
+    if start < len(data):
+        runs.append((start, len(data)))
+
+    return runs
+
+
+def programmed_length(data):
+    """
+    returns length of data without erased words at the end
+    """
+    length = len(bytes(data).rstrip(b'\xff'))
+    return length + length % WORD_SIZE
+
+
+class BinDumpWriter(object):
+    """
+    Writes memory chunks into preallocated binary file at their offsets
+    """
+
+    def __init__(self, fname, size, trim_erased, state=None):
+        """
+        size        --- memory size in bytes
+        trim_erased --- drop erased words from the end of file
+        state       --- writer state from checkpoint to continue with
+        """
+        self.size = size
+        self.trim_erased = trim_erased
+
+        if state is None:
+            self.file = open(fname, "w+b")
+            self.file.truncate(size)
+            self.end = 0
+        else:
+            self.file = open(fname, "r+b")
+            self.end = state["end"]
+
+    def write(self, offset, data):
+        self.file.seek(offset)
+        self.file.write(data)
+
+        programmed = programmed_length(data)
+
+        if programmed:
+            self.end = max(self.end, offset + programmed)
+
+    def state(self):
+        self.file.flush()
+        return {"end": self.end}
+
+    def finish(self):
+        self.file.truncate(self.end if self.trim_erased else self.size)
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+
+class HexDumpWriter(object):
+    """
+    Streams memory chunks as Intel HEX records. Chunks must come
+        in address order and start at word boundary.
+    """
+
+    def __init__(self, fname, skip_erased, state=None):
+        """
+        skip_erased --- do not write erased words
+        state       --- writer state from checkpoint to continue with
+        """
+        self.skip_erased = skip_erased
+
+        if state is None:
+            self.file = open(fname, "wb")
+            self.upper = 0
+        else:
+            self.file = open(fname, "r+b")
+            self.file.truncate(state["file_size"])
+            self.file.seek(state["file_size"])
+            self.upper = state["upper"]
+
+    def write(self, offset, data):
+        lines = []
+
+        for start, stop in self.__programmed_runs(data):
+            address = offset + start
+
+            while start < stop:
+                # Records must not cross 64K boundary
+                upper = address >> 16
+                length = min(stop - start, 0x10000 - (address & 0xFFFF))
+
+                if upper != self.upper:
+                    lines.append(hex_record(HEX_EXT_LINEAR_ADDR_RECORD, 0,
+                                            bytes([upper >> 8,
+                                                   upper & 0xFF])))
+                    self.upper = upper
+
+                lines.extend(self.__data_records(address & 0xFFFF,
+                                                 bytes(data[start:
+                                                            start + length])))
+                start += length
+                address += length
+
+        self.file.write("".join(lines).encode('ascii'))
+
+    def __data_records(self, address, data):
+        """
+        Splits data into records. Data is converted to hex at once,
+            only checksums are computed per record.
+        """
+        hex_data = data.hex().upper()
+        records = []
+
+        for i in range(0, len(data), HEX_RECORD_SIZE):
+            chunk = data[i:i + HEX_RECORD_SIZE]
+            record_address = address + i
+
+            checksum = (-(len(chunk) + (record_address >> 8) +
+                          (record_address & 0xFF) + HEX_DATA_RECORD +
+                          sum(chunk))) & 0xFF
+
+            records.append(":%02X%04X%02X%s%02X\n" %
+                           (len(chunk), record_address, HEX_DATA_RECORD,
+                            hex_data[2 * i:2 * (i + len(chunk))], checksum))
+
+        return records
+
+    def __programmed_runs(self, data):
+        """
+        returns list of (start, stop) of data to be written
+        """
+        if not self.skip_erased:
+            return [(0, len(data))]
+
+        return programmed_word_runs(data)
+
+    def __write_record(self, record_type, address, data=b''):
+        self.file.write(hex_record(record_type, address, data).
+                        encode('ascii'))
+
+    def state(self):
+        self.file.flush()
+        return {"file_size": self.file.tell(), "upper": self.upper}
+
+    def finish(self):
+        self.__write_record(HEX_EOF_RECORD, 0)
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+
+def create_dump_writer(fname, memory_t, size, state=None):
+    """
+    Creates writer by file extension. Flash dumps are cleared from
+        erased words.
+    """
+    extension = fname.split('.')[-1]
+    flash = memory_t == 'flash'
+
+    if extension == 'bin':
+        return BinDumpWriter(fname, size, flash, state)
+
+    elif extension == 'hex':
+        return HexDumpWriter(fname, flash, state)
+
+    raise ValueError("Wrong file extention: " + extension)
+
+
+class DumpCheckpoint(object):
+    """
+    Progress of memory dump. Kept next to the dump while it is
+        not complete.
+    """
+
+    def __init__(self, fname):
+        self.fname = fname + ".partial"
+
+    def load(self, memory_t, size):
+        """
+        returns (bytes done, writer state) or None if there is nothing
+            to continue
+        """
+        try:
+            with open(self.fname, "r") as f:
+                checkpoint = json.load(f)
+
+        except (IOError, OSError, ValueError):
+            return None
+
+        if (checkpoint.get("memory") != memory_t) or\
+                (checkpoint.get("size") != size):
+            return None
+
+        return checkpoint["done"], checkpoint["writer"]
+
+    def save(self, memory_t, size, done, writer_state):
+        tmp_fname = self.fname + ".tmp"
+
+        with open(tmp_fname, "w") as f:
+            json.dump({"memory": memory_t, "size": size, "done": done,
+                       "writer": writer_state}, f)
+
+        os.rename(tmp_fname, self.fname)
+
+    def remove(self):
+        try:
+            os.unlink(self.fname)
+        except (IOError, OSError):
+            pass
@@ -0,0 +1,88 @@
+"""
+Durations of device operations measured by programmer.
+"""
+import json
+import os
+import re
+
+
+DEFAULT_TIMINGS_DIR = os.path.join(os.path.expanduser("~"), ".bigblack",
+                                   "timings")
+
+# Number of the latest durations kept for every operation
+MAX_DURATIONS = 16
+
+
+class OperationTimings(object):
+    """
+    Keeps measured durations by operation name. Programmer which polls
+        device for completion starts polling after the shortest known
+        duration instead of polling from the beginning.
+    """
+
+    def __init__(self, durations=None):
+        """
+        durations   --- dict operation -> list of durations in seconds
+        """
+        self.durations = durations if durations is not None else {}
+
+    def record(self, operation, duration):
+        durations = self.durations.setdefault(operation, [])
+        durations.append(duration)
+
+        # Device could be replaced, so old durations are dropped
+        del durations[:-MAX_DURATIONS]
+
+    def shortest(self, operation):
+        """
+        returns the shortest duration of operation or None if it was
+            not measured yet
+        """
+        durations = self.durations.get(operation)
+
+        if not durations:
+            return None
+
+        return min(durations)
+
+
+class OperationTimingsStore(object):
+    """
+    Keeps timings of every device between runs, so polling starts from
+        durations measured last time.
+    """
+
+    def __init__(self, directory=DEFAULT_TIMINGS_DIR):
+        self.directory = directory
+
+    def load(self, device_key):
+        """
+        returns OperationTimings. They are empty if device is unknown.
+        """
+        try:
+            with open(self.__get_fname(device_key), "r") as f:
+                durations = dict(
+                    (operation, [float(d) for d in values][-MAX_DURATIONS:])
+                    for operation, values in json.load(f).items())
+
+        except (IOError, OSError, ValueError, TypeError, AttributeError):
+            # Broken file is the same as no file
+            return OperationTimings()
+
+        return OperationTimings(durations)
+
+    def save(self, device_key, timings):
+        fname = self.__get_fname(device_key)
+        tmp_fname = fname + ".tmp"
+
+        # Several programmers may save at once
+        os.makedirs(self.directory, exist_ok=True)
+
+        with open(tmp_fname, "w") as f:
+            json.dump(timings.durations, f)
+
+        os.rename(tmp_fname, fname)
+
+    def __get_fname(self, device_key):
+        return os.path.join(self.directory,
+                            re.sub(r"[^\w.-]", "_", device_key) + ".json")
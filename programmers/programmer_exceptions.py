@@ -20,3 +20,26 @@ class WrongPacketError(ProgrammerBaseError):
     """
     def __init__(self, m=""):
         super(WrongPacketError, self).__init__(m)
+
+
+class ChunkTransferError(ProgrammerBaseError):
+    """
+    Raised if program memory chunk was not accepted by device.
+        Keeps the failed chunk so that it could be resent.
+    """
+    def __init__(self, chunk, m=""):
+        super(ChunkTransferError, self).__init__(
+            "Chunk #%d at 0x%06x (%d bytes) failed: %s" %
+            (chunk.index, chunk.address, chunk.length, m))
+        self.chunk = chunk
+
+
+class VerificationError(ProgrammerBaseError):
+    """
+    Raised if memory contents differ from written data
+    """
+    def __init__(self, address, expected, actual, mismatches=1):
+        super(VerificationError, self).__init__(
+            "Verification failed at 0x%06x: expected 0x%02x, got 0x%02x "
+            "(%d bytes differ)" % (address, expected, actual, mismatches))
+        self.address = address